@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BfoolappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bfoolapp'
+
+    def ready(self):
+        # Connects the per-connection hooks (query instrumentation, SQLite
+        # PRAGMAs) before any connection opens
+        from . import db, middleware  # noqa: F401
@@ -0,0 +1,253 @@
+"""
+Async (ASGI) versions of the read-only endpoints.
+
+DRF's APIView cannot run async handlers, so these are plain Django async
+views that reuse the values()-based representations and talk to the
+database through the async ORM. Served by bookishfool.asgi like every
+other URL; under WSGI Django still runs them, just without the benefit.
+"""
+import asyncio
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import check_user
+from .cache import cached_user_key
+from .models import Author, Book, Borrow, Category, Hold, UserProfile
+from .pagination import KeysetPagination, PopularityPagination
+from .renderers import dumps
+from .representations import (
+    AUTHOR_OUTPUT, BOOK_EXPANDABLE, BOOK_OUTPUT, BORROW_EXPANDABLE, BORROW_OUTPUT, Fieldset, FieldsetError,
+    author_rows, book_author_rows, book_authors_wanted, book_columns, book_rows, borrow_authors_wanted, borrow_rows,
+    category_rows, group_authors, hold_rows,
+    represent_authors, represent_books, represent_borrows, represent_categories, represent_holds,
+)
+from .services import hold_positions
+
+
+class NotAuthenticated(Exception):
+    pass
+
+
+async def authenticate(request):
+    """Async equivalent of JWTAuthentication.authenticate(); returns a User or None."""
+    jwt = JWTAuthentication()
+    header = jwt.get_header(request)
+    if header is None:
+        return None
+    raw_token = jwt.get_raw_token(header)
+    if raw_token is None:
+        return None
+    try:
+        token = jwt.get_validated_token(raw_token)  # signature and expiry only, no I/O
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        raise NotAuthenticated('Given token not valid for any token type')
+    # Shares CachedJWTAuthentication's cache entries
+    key = cached_user_key(user_id)
+    user = await cache.aget(key)
+    if user is None:
+        try:
+            user = await User.objects.select_related('userprofile').aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise NotAuthenticated('User not found')
+        await cache.aset(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    try:
+        check_user(user, token)
+    except AuthenticationFailed as e:
+        raise NotAuthenticated(str(e.detail['detail']))
+    return user
+
+
+def json_response(data, status=200):
+    # Same encoder as the DRF views (settings.JSON_BACKEND)
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    # None: anyone; 'user': any authenticated user; 'admin': staff only
+    requires = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await authenticate(request)
+        except NotAuthenticated as e:
+            return json_response({'detail': str(e)}, status=401)
+
+        if self.requires and request.user is None:
+            return json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+        if self.requires == 'admin' and not request.user.is_staff:
+            return json_response({'detail': 'You do not have permission to perform this action.'}, status=403)
+        # The same buckets as the DRF views; the local-memory cache doesn't block the loop
+        for throttle in [throttle() for throttle in api_settings.DEFAULT_THROTTLE_CLASSES]:
+            if not throttle.allow_request(request, self):
+                wait = math.ceil(throttle.wait())
+                response = json_response(
+                    {'detail': f'Request was throttled. Expected available in {wait} seconds.'}, status=429
+                )
+                response['Retry-After'] = str(wait)
+                return response
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except FieldsetError as e:
+            return json_response({e.param: [str(e)]}, status=400)
+
+    def page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', api_settings.PAGE_SIZE))
+        except ValueError:
+            page_size = api_settings.PAGE_SIZE
+        return min(max(page_size, 1), KeysetPagination.max_page_size)
+
+    def next_page(self, page, page_size, after):
+        has_next = len(page) > page_size
+        page = page[:page_size]
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(self.request.build_absolute_uri(), 'after', after(page[-1]))
+        return page, next_url
+
+    async def keyset_page(self, rows):
+        """Forward-only keyset page over ``rows`` (a values() queryset): ``?after=<id>&page_size=``."""
+        try:
+            after = int(self.request.GET.get('after', 0))
+        except ValueError:
+            after = 0
+        page_size = self.page_size()
+        page = [row async for row in rows.filter(id__gt=after).order_by('id')[:page_size + 1]]
+        return self.next_page(page, page_size, lambda row: row['id'])
+
+    async def popularity_page(self, rows):
+        """
+        Most borrowed first, like PopularityPagination: ``?after=<recent_borrow_count>:<id>``.
+        ``rows`` must include recent_borrow_count.
+        """
+        rows = rows.order_by(*PopularityPagination.ordering)
+        page_size = self.page_size()
+        try:
+            count, last_id = (int(part) for part in self.request.GET['after'].split(':'))
+        except (KeyError, ValueError):
+            page = [row async for row in rows[:page_size + 1]]
+        else:
+            # Two index seeks on book_popular_idx: the rest of this count's ties, then lower counts
+            page = [row async for row in rows.filter(recent_borrow_count=count, id__lt=last_id)[:page_size + 1]]
+            if len(page) <= page_size:
+                page += [row async for row in rows.filter(recent_borrow_count__lt=count)[:page_size + 1 - len(page)]]
+        return self.next_page(page, page_size, lambda row: f"{row['recent_borrow_count']}:{row['id']}")
+
+
+async def fetch_authors(book_ids, bio=True):
+    return group_authors([row async for row in book_author_rows(book_ids, bio)])
+
+
+class AsyncBookListView(AsyncAPIView):
+    async def get(self, request):
+        queryset = Book.objects.all()
+        if request.GET.get('author'):
+            queryset = queryset.filter(authors__id=request.GET['author'])
+        if request.GET.get('category'):
+            queryset = queryset.filter(category__id=request.GET['category'])
+        if request.GET.get('available') == 'true':
+            queryset = queryset.filter(available_copies__gt=0)  # book_available_idx
+        fieldset = Fieldset.from_query(request.GET, BOOK_OUTPUT, BOOK_EXPANDABLE)
+
+        ordering = request.GET.get('ordering')
+        if ordering == 'popular':
+            rows = queryset.values(*book_columns(fieldset), 'recent_borrow_count')
+            page, next_url = await self.popularity_page(rows)
+        elif ordering:
+            return json_response({'ordering': 'Only "popular" is supported.'}, status=400)
+        else:
+            page, next_url = await self.keyset_page(book_rows(queryset, fieldset))
+        wanted, bio = book_authors_wanted(fieldset)
+        authors = await fetch_authors([row['id'] for row in page], bio) if wanted else {}
+        return json_response({'next': next_url, 'previous': None, 'results': represent_books(page, authors, fieldset)})
+
+
+class AsyncAuthorListView(AsyncAPIView):
+    requires = 'admin'  # same as AuthorListCreateAPIView
+
+    async def get(self, request):
+        fieldset = Fieldset.from_query(request.GET, AUTHOR_OUTPUT)
+        page, next_url = await self.keyset_page(author_rows(Author.objects.all(), fieldset))
+        return json_response({'next': next_url, 'previous': None, 'results': represent_authors(page, fieldset)})
+
+
+class AsyncCategoryListView(AsyncAPIView):
+    requires = 'admin'  # same as CategoryListCreateAPIView
+
+    async def get(self, request):
+        page, next_url = await self.keyset_page(category_rows(Category.objects.all()))
+        return json_response({'next': next_url, 'previous': None, 'results': represent_categories(page)})
+
+
+class AsyncActiveBorrowListView(AsyncAPIView):
+    requires = 'user'
+
+    async def get(self, request):
+        fieldset = Fieldset.from_query(request.GET, BORROW_OUTPUT, BORROW_EXPANDABLE)
+        queryset = Borrow.objects.filter(user=request.user).active().order_by('id')
+        rows = [row async for row in borrow_rows(queryset, fieldset)]
+        authors = await fetch_authors({row['book__id'] for row in rows}) if borrow_authors_wanted(fieldset) else {}
+        return json_response(represent_borrows(rows, authors, fieldset))
+
+
+class AsyncUserPenaltyView(AsyncAPIView):
+    requires = 'user'
+
+    async def get(self, request, id):
+        if request.user.id != id and not request.user.is_staff:
+            return json_response({'detail': 'Not authorized to view this user\'s penalties.'}, status=403)
+        try:
+            profile = await UserProfile.objects.select_related('user').aget(user_id=id)
+        except UserProfile.DoesNotExist:
+            try:
+                user = await User.objects.aget(pk=id)
+            except User.DoesNotExist:
+                return json_response({'detail': 'No User matches the given query.'}, status=404)
+            profile, _ = await UserProfile.objects.aget_or_create(user=user)
+        return json_response({'username': profile.user.username, 'penalty_points': profile.penalty_point})
+
+
+class AsyncHoldStatusView(AsyncAPIView):
+    """
+    Long-poll one hold: ``?status=<last seen>&wait=<seconds>`` answers as soon
+    as the status differs from the one given, or after ``wait`` with the
+    unchanged hold. Under ASGI waiting costs one primary key lookup per
+    interval and no worker thread, instead of a client retrying POST /api/borrow/.
+    """
+    requires = 'user'
+    max_wait = 30
+    poll_interval = 1.0
+
+    async def get(self, request, id):
+        holds = Hold.objects.filter(pk=id, user=request.user)
+        try:
+            wait = min(max(int(request.GET.get('wait', 0)), 0), self.max_wait)
+        except ValueError:
+            return json_response({'detail': 'wait must be a number of seconds.'}, status=400)
+        known = request.GET.get('status')
+
+        deadline = time.monotonic() + wait
+        while True:
+            current = await holds.values_list('status', flat=True).afirst()
+            if current is None:
+                return json_response({'detail': 'No Hold matches the given query.'}, status=404)
+            if current != known or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+        rows = [row async for row in hold_rows(holds)]
+        positions = await sync_to_async(hold_positions)([id])
+        return json_response(represent_holds(rows, positions)[0])
@@ -0,0 +1,65 @@
+"""
+JWT authentication without a User query on every request.
+
+CachedJWTAuthentication keeps the resolved user (with its profile) in the
+cache for AUTH_USER_CACHE_TIMEOUT seconds; saving or deleting a User or
+UserProfile drops the entry (see the receivers in models.py). The profile's
+counters are moved with UPDATE statements that send no signals, so read
+them from the database, not from request.user.userprofile.
+
+StatelessReadsMixin authenticates safe-method requests from the token
+claims alone (username and is_staff are added at login), for read-only
+endpoints that only need the user's id.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import cached_user_key
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        key = cached_user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = self.user_model.objects.select_related('userprofile').get(
+                    **{jwt_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        check_user(user, validated_token)
+        return user
+
+
+def check_user(user, validated_token):
+    """
+    The checks JWTAuthentication.get_user makes once it has the user, for
+    cached users too; shared with the async views. Raises AuthenticationFailed.
+    """
+    if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+        raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    if jwt_settings.CHECK_REVOKE_TOKEN:
+        if validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+
+class StatelessReadsMixin:
+    """Authenticate GET/HEAD/OPTIONS with a TokenUser built from the token; writes use the default classes."""
+
+    def get_authenticators(self):
+        if self.request.method in SAFE_METHODS:
+            return [JWTStatelessUserAuthentication()]
+        return super().get_authenticators()
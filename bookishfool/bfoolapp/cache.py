@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_MODIFIED_KEY = 'catalogue:modified'
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, 1, timeout=None)
+        cache.add(CATALOGUE_MODIFIED_KEY, time.time(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalogue_version():
+    # Every cached catalogue response is keyed on the version, so bumping it
+    # invalidates them all without having to know which keys exist
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, 1, timeout=None)
+    cache.set(CATALOGUE_MODIFIED_KEY, time.time(), timeout=None)
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    catalogue_version()
+    modified = cache.get(CATALOGUE_MODIFIED_KEY)
+    if modified is None:
+        return None
+    return datetime.fromtimestamp(int(modified), tz=dt_timezone.utc)
+
+
+def _params_digest(request):
+    params = sorted(request.query_params.lists())
+    raw = f'{request.get_host()}{request.path}?{params}'
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def catalogue_etag(request, *args, **kwargs):
+    return f'{catalogue_version()}-{_params_digest(request)}'
+
+
+def coalesced(key, build):
+    """
+    Call ``build()`` once for all threads of this process asking for ``key``
+    at the same time: the first runs it, the others wait and share its
+    result, or its exception.
+    """
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = Future()
+    if not leader:
+        return call.result()
+    try:
+        result = build()
+    except BaseException as e:
+        call.set_exception(e)
+        raise
+    else:
+        call.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+
+def coalesced_catalogue_build(request, build, kind):
+    """``build()``, run once for concurrent identical catalogue requests (settings.CATALOGUE_COALESCE)."""
+    if not settings.CATALOGUE_COALESCE:
+        return build()
+    return coalesced(f'catalogue:{kind}:{catalogue_version()}:{_params_digest(request)}', build)
+
+
+def cached_catalogue_response(request, build):
+    """Return the data for this catalogue request, calling ``build()`` only on a miss."""
+    key = f'catalogue:response:{catalogue_version()}:{_params_digest(request)}'
+    data = cache.get(key)
+    if data is None:
+        data = coalesced_catalogue_build(request, lambda: _build_and_cache(key, build), 'response')
+    return data
+
+
+def _build_and_cache(key, build):
+    data = build()
+    cache.set(key, data, settings.CATALOGUE_CACHE_TIMEOUT)
+    return data
+
+
+def cached_user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    cache.delete(cached_user_key(user_id))
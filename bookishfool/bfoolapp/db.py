@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.postgres.indexes import OpClass
+from django.db import models
+from django.db.backends.signals import connection_created
+from django.db.models.functions import Cast, Collate, Upper
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # On the raw connection, like Django's own init_command: no wrappers, no query log
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+
+class PrefixIndex(models.Index):
+    """
+    An index on ``fields`` that serves case-insensitive prefix searches
+    (``__istartswith``), which Django compiles to LIKE. SQLite only uses an
+    index for that when it is NOCASE; PostgreSQL needs a text_pattern_ops
+    index on the UPPER(column::text) that Django puts on the left side.
+    Other databases get a plain index.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            index = models.Index(*[Collate(field, 'NOCASE') for field in self.fields], name=self.name)
+        elif vendor == 'postgresql':
+            index = models.Index(
+                *[OpClass(Upper(Cast(field, models.TextField())), 'text_pattern_ops') for field in self.fields],
+                name=self.name,
+            )
+        else:
+            index = models.Index(fields=self.fields, name=self.name)
+        return index.create_sql(model, schema_editor, using=using, **kwargs)
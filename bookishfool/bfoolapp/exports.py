@@ -0,0 +1,45 @@
+import csv
+import json
+from itertools import islice
+
+
+CSV_COLUMNS = [
+    'id', 'title', 'description', 'total_copies', 'available_copies',
+    'category_id', 'category_name', 'author_ids', 'author_names', 'updated_at',
+]
+
+
+class Echo:
+    # csv.writer wants a file; hand each formatted row straight back instead
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(chunks):
+    for books in chunks:
+        yield ''.join(json.dumps(book, ensure_ascii=False, separators=(',', ':')) + '\n' for book in books)
+
+
+def csv_lines(chunks):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for books in chunks:
+        yield ''.join(
+            writer.writerow([
+                book['id'], book['title'], book['description'], book['total_copies'],
+                book['available_copies'], book['category']['id'], book['category']['name'],
+                '|'.join(str(author['id']) for author in book['authors']),
+                '|'.join(author['name'] for author in book['authors']),
+                book['updated_at'],
+            ])
+            for book in books
+        )
+
+
+def rows_csv_lines(columns, rows, chunk_size=2000):
+    """A header and the rows of a values_list() iterator, a chunk of lines at a time."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield ''.join(writer.writerow(row) for row in chunk)
@@ -0,0 +1,38 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bfoolapp.services import ARCHIVE_AFTER, POPULARITY_WINDOW, archive_returned_borrows
+
+
+class Command(BaseCommand):
+    help = (
+        'Move loans returned more than --days ago into the archive table, so the Borrow table stays '
+        'about the size of current circulation. Loan history still shows them. Run daily.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER.days,
+                            help=f'Keep loans returned in the last DAYS days (at least {POPULARITY_WINDOW.days}).')
+        parser.add_argument('--date', help='Count the days back from this date (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+
+        started = time.perf_counter()
+        try:
+            archived = archive_returned_borrows(
+                today=today, keep=timedelta(days=options['days']), batch_size=options['batch_size']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} returned loan(s) in {time.perf_counter() - started:.2f}s.'
+        ))
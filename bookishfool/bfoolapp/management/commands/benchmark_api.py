@@ -0,0 +1,341 @@
+import io
+import itertools
+import json
+import logging
+import random
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from bfoolapp import urls
+from bfoolapp.models import Author, Book, Category
+from bfoolapp.services import borrow_book, place_hold
+
+from .generate_data import PASSWORD, WORDS
+
+
+HTTP_METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def endpoints():
+    """(url name, method) for every handler routed in bfoolapp.urls."""
+    for pattern in urls.urlpatterns:
+        view_class = pattern.callback.view_class
+        for method in HTTP_METHODS:
+            if hasattr(view_class, method):
+                yield pattern.name, method.upper()
+
+
+def scenario_name(name, method):
+    return f'{name}__{method.lower()}'.replace('-', '_')
+
+
+class Scenarios:
+    """
+    One method per endpoint, named ``<url name>__<method>`` with dashes as
+    underscores. Each call runs outside the timed section and returns the
+    request to time: (path, payload, user or None); writes get fresh rows
+    so every iteration does the same amount of work.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.sequence = itertools.count()
+        self.admin = User.objects.create_superuser('bench_admin', 'admin@example.com', PASSWORD)
+        self.reader = User.objects.exclude(pk=self.admin.pk).order_by('pk').first()
+        self.book_ids = list(Book.objects.values_list('pk', flat=True))
+        self.author_ids = list(Author.objects.values_list('pk', flat=True))
+        self.category_ids = list(Category.objects.values_list('pk', flat=True))
+
+    def fresh_user(self):
+        # No password hashing: authentication is by token
+        return User.objects.create(username=f'bench_fresh_{next(self.sequence)}')
+
+    def lendable_books(self, count):
+        return list(
+            Book.objects.filter(available_copies__gt=0).order_by('?').values_list('pk', flat=True)[:count]
+        )
+
+    def new_book(self, available=1):
+        return Book.objects.create(
+            title=f'Bench {next(self.sequence)}', description='', total_copies=1, available_copies=available,
+            category_id=self.rng.choice(self.category_ids),
+        )
+
+    def new_hold(self):
+        user = self.fresh_user()
+        return user, place_hold(user, self.new_book(available=0))
+
+    def register__post(self):
+        n = next(self.sequence)
+        return reverse('register'), {'username': f'bench_reg_{n}', 'email': f'r{n}@example.com', 'password': PASSWORD}, None
+
+    def login__post(self):
+        return reverse('login'), {'username': self.reader.username, 'password': PASSWORD}, None
+
+    def token_refresh__post(self):
+        return reverse('token_refresh'), {'refresh': str(RefreshToken.for_user(self.reader))}, None
+
+    def books__get(self):
+        return reverse('books') + '?page_size=50', None, None
+
+    def books__post(self):
+        payload = {
+            'title': f'Bench {next(self.sequence)}', 'description': 'Benchmark book', 'total_copies': 3, 'available_copies': 3,
+            'author_ids': self.rng.sample(self.author_ids, 2), 'category_id': self.rng.choice(self.category_ids),
+        }
+        return reverse('books'), payload, self.admin
+
+    def books_search__get(self):
+        return reverse('books-search') + f'?q={self.rng.choice(WORDS)}', None, None
+
+    def books_export__get(self):
+        return reverse('books-export') + '?type=ndjson', None, self.admin
+
+    def ingest_items(self, count, **fields):
+        n = next(self.sequence)
+        return [{'external_id': f'bench-{n}-{i}', **fields} for i in range(count)]
+
+    def books_bulk__post(self):
+        items = self.ingest_items(
+            500, title='Bench', description='Benchmark book', total_copies=2, available_copies=2,
+            category_id=self.rng.choice(self.category_ids),
+        )
+        for item in items:
+            item['author_ids'] = self.rng.sample(self.author_ids, 2)
+        return reverse('books-bulk'), {'items': items}, self.admin
+
+    def books_details__put(self):
+        return reverse('books_details', args=[self.rng.choice(self.book_ids)]), {'description': 'Updated'}, self.admin
+
+    def books_details__delete(self):
+        return reverse('books_details', args=[self.new_book().pk]), None, self.admin
+
+    def author_list_create__get(self):
+        return reverse('author-list-create') + '?page_size=50', None, self.admin
+
+    def author_list_create__post(self):
+        return reverse('author-list-create'), {'name': f'Bench Author {next(self.sequence)}', 'bio': ''}, self.admin
+
+    def author_bulk__post(self):
+        return reverse('author-bulk'), {'items': self.ingest_items(500, name='Bench Author', bio='')}, self.admin
+
+    def author_detail__put(self):
+        return reverse('author-detail', args=[self.rng.choice(self.author_ids)]), {'bio': 'Updated'}, self.admin
+
+    def author_detail__delete(self):
+        author = Author.objects.create(name=f'Bench Author {next(self.sequence)}')
+        return reverse('author-detail', args=[author.pk]), None, self.admin
+
+    def category_list_create__get(self):
+        return reverse('category-list-create'), None, self.admin
+
+    def category_list_create__post(self):
+        return reverse('category-list-create'), {'name': f'Bench Category {next(self.sequence)}'}, self.admin
+
+    def category_bulk__post(self):
+        return reverse('category-bulk'), {'items': self.ingest_items(100, name='Bench Category')}, self.admin
+
+    def category_detail__put(self):
+        category_id = self.rng.choice(self.category_ids)
+        return reverse('category-detail', args=[category_id]), {'name': f'Category {category_id}'}, self.admin
+
+    def category_detail__delete(self):
+        category = Category.objects.create(name=f'Bench Category {next(self.sequence)}')
+        return reverse('category-detail', args=[category.pk]), None, self.admin
+
+    def borrow_book__get(self):
+        return reverse('borrow-book'), None, self.reader
+
+    def borrow_book__post(self):
+        return reverse('borrow-book'), {'book_id': self.lendable_books(1)[0]}, self.fresh_user()
+
+    def return_book__post(self):
+        user = self.fresh_user()
+        borrow = borrow_book(user, Book.objects.get(pk=self.lendable_books(1)[0]))
+        return reverse('return-book'), {'borrow_id': borrow.pk}, user
+
+    def bulk_borrow__post(self):
+        return reverse('bulk-borrow'), {'book_ids': self.lendable_books(3)}, self.fresh_user()
+
+    def bulk_return__post(self):
+        user = self.fresh_user()
+        books = Book.objects.filter(pk__in=self.lendable_books(3))
+        borrow_ids = [borrow_book(user, book).pk for book in books]
+        return reverse('bulk-return'), {'borrow_ids': borrow_ids}, user
+
+    def holds__get(self):
+        return reverse('holds'), None, self.new_hold()[0]
+
+    def holds__post(self):
+        return reverse('holds'), {'book_id': self.new_book(available=0).pk}, self.fresh_user()
+
+    def hold_detail__delete(self):
+        user, hold = self.new_hold()
+        return reverse('hold-detail', args=[hold.pk]), None, user
+
+    def user_penalties__get(self):
+        return reverse('user-penalties', args=[self.reader.pk]), None, self.reader
+
+    def user_loans__get(self):
+        return reverse('user-loans', args=[self.reader.pk]) + '?page_size=50', None, self.reader
+
+    def metrics__get(self):
+        return reverse('metrics'), None, self.admin
+
+    def async_books__get(self):
+        return reverse('async-books') + '?page_size=50', None, None
+
+    def async_authors__get(self):
+        return reverse('async-authors') + '?page_size=50', None, self.admin
+
+    def async_categories__get(self):
+        return reverse('async-categories'), None, self.admin
+
+    def async_borrow__get(self):
+        return reverse('async-borrow'), None, self.reader
+
+    def async_user_penalties__get(self):
+        return reverse('async-user-penalties', args=[self.reader.pk]), None, self.reader
+
+    def async_hold_status__get(self):
+        # Answers at once: the status differs from the one given
+        user, hold = self.new_hold()
+        return reverse('async-hold-status', args=[hold.pk]) + '?status=none&wait=30', None, user
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every bfoolapp endpoint through the test client on generated datasets of several sizes, '
+        'in a scratch database. Reports latency percentiles and query counts, and optionally fails on '
+        'regressions against a saved baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                            help='Number of books per dataset; users, authors and borrows scale with it.')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--only', nargs='+', default=[], help='Limit the run to these url names.')
+        parser.add_argument('--baseline', type=Path, help='JSON results of an earlier run to compare against.')
+        parser.add_argument('--save-baseline', type=Path, help='Write this run\'s results as JSON.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed relative p95 slowdown before a regression is reported.')
+        parser.add_argument('--noise-floor', type=float, default=2.0,
+                            help='p95 slowdowns smaller than this many ms are never regressions.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        missing = [
+            f'{name} {method}' for name, method in endpoints()
+            if not hasattr(Scenarios, scenario_name(name, method))
+        ]
+        if missing:
+            raise CommandError(f'No benchmark scenario for: {", ".join(missing)}')
+
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        # Request and slow-query logs would interleave with the report
+        logging.disable(logging.WARNING)
+        results = {}
+        # Every scenario repeats a request from one client: measure the handlers, not the throttles
+        unthrottled = override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}})
+        unthrottled.enable()
+        try:
+            for size in options['sizes']:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    results[str(size)] = self.run_size(size, options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            unthrottled.disable()
+            logging.disable(logging.NOTSET)
+
+        if options['save_baseline']:
+            options['save_baseline'].write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f"Saved results to {options['save_baseline']}")
+        if options['baseline']:
+            regressions = self.compare(json.loads(options['baseline'].read_text()), results, options)
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(line)
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def run_size(self, size, options):
+        call_command(
+            'generate_data', users=max(size // 5, 10), authors=max(size // 20, 10), categories=20,
+            books=size, borrows=size * 10, seed=options['seed'], stdout=io.StringIO(),
+        )
+        cache.clear()
+        scenarios = Scenarios(random.Random(options['seed']))
+        client = Client()
+
+        self.stdout.write(f'\n{size} books')
+        self.stdout.write(f'{"endpoint":<34}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}')
+        measured = {}
+        for name, method in endpoints():
+            if options['only'] and name not in options['only']:
+                continue
+            scenario = getattr(scenarios, scenario_name(name, method))
+            timings, queries = [], 0
+            for _ in range(options['iterations']):
+                path, payload, user = scenario()
+                headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.generic(
+                        method, path, json.dumps(payload) if payload is not None else '',
+                        content_type='application/json', headers=headers,
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    timings.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    raise CommandError(f'{method} {path} returned {response.status_code}: {response.content[:200]!r}')
+                queries = max(queries, len(captured))
+
+            timings.sort()
+            key = f'{name} {method}'
+            measured[key] = {
+                'p50': round(percentile(timings, 0.50) * 1000, 2),
+                'p95': round(percentile(timings, 0.95) * 1000, 2),
+                'p99': round(percentile(timings, 0.99) * 1000, 2),
+                'queries': queries,
+            }
+            self.stdout.write(
+                f'{key:<34}{measured[key]["p50"]:>9.2f}{measured[key]["p95"]:>9.2f}'
+                f'{measured[key]["p99"]:>9.2f}{queries:>9}'
+            )
+        return measured
+
+    def compare(self, baseline, results, options):
+        regressions = []
+        for size, measured in results.items():
+            for key, current in measured.items():
+                previous = baseline.get(size, {}).get(key)
+                if previous is None:
+                    continue
+                if current['queries'] > previous['queries']:
+                    regressions.append(
+                        f'{size} books, {key}: {current["queries"]} queries (baseline {previous["queries"]})'
+                    )
+                slower = current['p95'] - previous['p95']
+                if slower > options['noise_floor'] and current['p95'] > previous['p95'] * (1 + options['tolerance']):
+                    regressions.append(
+                        f'{size} books, {key}: p95 {current["p95"]:.2f} ms (baseline {previous["p95"]:.2f} ms)'
+                    )
+        return regressions
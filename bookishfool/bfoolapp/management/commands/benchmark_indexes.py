@@ -0,0 +1,86 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand
+
+
+SCHEMA = '''
+CREATE TABLE bfoolapp_borrow (
+    id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    borrow_date date NOT NULL,
+    due_date date NOT NULL,
+    return_date date NULL,
+    book_id bigint NOT NULL,
+    user_id integer NOT NULL
+);
+CREATE INDEX bfoolapp_borrow_book_id ON bfoolapp_borrow (book_id);
+CREATE INDEX bfoolapp_borrow_user_id ON bfoolapp_borrow (user_id);
+'''
+
+# Mirrors Borrow.Meta.indexes (migration 0002_query_indexes)
+INDEXES = '''
+CREATE INDEX borrow_active_user_idx ON bfoolapp_borrow (user_id) WHERE return_date IS NULL;
+CREATE INDEX borrow_due_return_idx ON bfoolapp_borrow (due_date, return_date);
+'''
+
+QUERIES = {
+    'active loans for user': (
+        'SELECT COUNT(*) FROM bfoolapp_borrow WHERE user_id = ? AND return_date IS NULL',
+        (42,),
+    ),
+    'overdue scan': (
+        "SELECT id, user_id, due_date FROM bfoolapp_borrow "
+        "WHERE due_date < date('2025-01-01', '+30 days') AND return_date IS NULL",
+        (),
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare SQLite query plans and timings for the Borrow hot paths with and without the tuned indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        db = sqlite3.connect(':memory:')
+        db.executescript(SCHEMA)
+        self.populate(db, options['rows'], options['users'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Without tuned indexes'))
+        self.report(db, options['repeat'])
+        db.executescript(INDEXES)
+        db.execute('ANALYZE')
+        self.stdout.write(self.style.MIGRATE_HEADING('With tuned indexes'))
+        self.report(db, options['repeat'])
+
+    def populate(self, db, rows, users):
+        started = time.perf_counter()
+        # About 2% of loans are still open; the rest were returned a week after borrowing
+        db.execute(
+            '''
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO bfoolapp_borrow (borrow_date, due_date, return_date, book_id, user_id)
+            SELECT date('2025-01-01', '+' || (n % 365) || ' days'),
+                   date('2025-01-01', '+' || (n % 365 + 14) || ' days'),
+                   CASE WHEN n % 50 = 0 THEN NULL ELSE date('2025-01-01', '+' || (n % 365 + 7) || ' days') END,
+                   n % 5000,
+                   n % ?
+            FROM seq
+            ''',
+            (rows, users),
+        )
+        db.commit()
+        self.stdout.write(f'Loaded {rows} borrow rows in {time.perf_counter() - started:.1f}s')
+
+    def report(self, db, repeat):
+        for label, (sql, params) in QUERIES.items():
+            plan = '; '.join(row[-1] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params))
+            started = time.perf_counter()
+            for _ in range(repeat):
+                db.execute(sql, params).fetchall()
+            per_query = (time.perf_counter() - started) / repeat * 1000
+            self.stdout.write(f'  {label}: {per_query:.2f} ms')
+            self.stdout.write(f'    plan: {plan}')
@@ -0,0 +1,75 @@
+import io
+import logging
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.text import compress_string
+
+from bfoolapp.models import Book
+from bfoolapp.renderers import FastJSONRenderer, orjson
+from bfoolapp.representations import book_rows, represent_books
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure render time and bytes on the wire of /api/books/ payloads per JSON backend, '
+        'with and without gzip, in a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Books per payload.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        backends = ['stdlib'] + (['orjson'] if orjson else [])
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        logging.disable(logging.WARNING)
+        try:
+            call_command(
+                'generate_data', users=10, authors=max(options['sizes']) // 20, books=max(options['sizes']),
+                borrows=0, stdout=io.StringIO(),
+            )
+            self.stdout.write(f'{"books":>7} {"backend":<8}{"render ms":>11}{"bytes":>12}{"gzip ms":>10}{"gzipped":>11}')
+            for size in options['sizes']:
+                # The view's page shape, at sizes its pagination caps at 100
+                rows = represent_books(book_rows(Book.objects.order_by('id')[:size]))
+                data = {'next': None, 'previous': None, 'results': rows}
+                for backend in backends:
+                    with override_settings(JSON_BACKEND=backend):
+                        body, render = self.measure(lambda: FastJSONRenderer().render(data), options['repeat'])
+                    compressed, gzip_time = self.measure(lambda: compress_string(body), options['repeat'])
+                    self.stdout.write(
+                        f'{size:>7} {backend:<8}{render * 1000:>11.2f}{len(body):>12,}'
+                        f'{gzip_time * 1000:>10.2f}{len(compressed):>11,}'
+                    )
+            self.measure_wire()
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def measure(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def measure_wire(self):
+        client = Client()
+        url = reverse('books') + '?page_size=100'
+        plain = client.get(url)
+        gzipped = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        revalidated = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped['ETag']})
+        self.stdout.write(
+            f'\nGET {url}: {len(plain.content):,} bytes, {len(gzipped.content):,} with gzip, '
+            f'{len(revalidated.content)} on revalidation ({revalidated.status_code}).'
+        )
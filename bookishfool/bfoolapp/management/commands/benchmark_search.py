@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from bfoolapp.models import Author, Book, Category
+from bfoolapp.search import backend, rebuild_index, search_books
+
+
+SYLLABLES = ['ka', 'lo', 'mer', 'tin', 'sha', 'dor', 'vel', 'qui', 'ran', 'zo', 'bel', 'nix', 'tor', 'ae']
+
+
+class Command(BaseCommand):
+    help = 'Compare catalogue search latency against icontains scans on synthetic books (rolled back afterwards).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = sorted({self.word(rng) for _ in range(20_000)})
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.populate(rng, vocabulary, options['books'])
+            rebuild_index()
+            self.stdout.write(
+                f"Loaded and indexed {options['books']} books ({backend()} backend) "
+                f'in {time.perf_counter() - started:.1f}s'
+            )
+
+            queries = [rng.choice(vocabulary) for _ in range(options['queries'])]
+            icontains = self.measure(queries, lambda q: list(
+                Book.objects.filter(
+                    Q(title__icontains=q) | Q(description__icontains=q) | Q(authors__name__icontains=q)
+                ).distinct().values_list('id', flat=True)[:10]
+            ))
+            indexed = self.measure(queries, lambda q: search_books(q, limit=10))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'icontains: p50 {icontains[0]:.2f} ms, p99 {icontains[1]:.2f} ms')
+        self.stdout.write(f'search:    p50 {indexed[0]:.2f} ms, p99 {indexed[1]:.2f} ms')
+
+    def word(self, rng):
+        return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+    def populate(self, rng, vocabulary, count):
+        category = Category.objects.create(name='Benchmark')
+        authors = Author.objects.bulk_create(
+            Author(name=f'{self.word(rng).title()} {self.word(rng).title()}') for _ in range(2000)
+        )
+        books = Book.objects.bulk_create(
+            (
+                Book(
+                    title=' '.join(rng.choices(vocabulary, k=3)).title(),
+                    description=' '.join(rng.choices(vocabulary, k=40)),
+                    category=category, total_copies=1, available_copies=1,
+                )
+                for _ in range(count)
+            ),
+            batch_size=2000,
+        )
+        Through = Book.authors.through
+        Through.objects.bulk_create(
+            (Through(book_id=book.pk, author_id=rng.choice(authors).pk) for book in books),
+            batch_size=5000,
+        )
+
+    def measure(self, queries, run):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
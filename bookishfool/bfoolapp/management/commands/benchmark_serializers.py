@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bfoolapp.models import Author, Book, Category
+from bfoolapp.representations import book_rows, represent_books
+from bfoolapp.serializers import BookSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of BookSerializer(many=True) against the values()-based book representation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--authors-per-book', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Synthetic rows live only inside this transaction and are rolled back
+        with transaction.atomic():
+            self.populate(options['rows'], options['authors_per_book'])
+            queryset = Book.objects.order_by('id')[:options['rows']]
+
+            serializer_rate = self.measure(
+                lambda: BookSerializer(queryset.with_details(), many=True).data,
+                options['rows'], options['repeat'],
+            )
+            values_rate = self.measure(
+                lambda: represent_books(book_rows(queryset)),
+                options['rows'], options['repeat'],
+            )
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'BookSerializer(many=True): {serializer_rate:,.0f} rows/s')
+        self.stdout.write(f'represent_books(values):  {values_rate:,.0f} rows/s')
+        self.stdout.write(f'speedup: {values_rate / serializer_rate:.1f}x')
+
+    def populate(self, rows, authors_per_book):
+        category = Category.objects.create(name='Benchmark')
+        authors = Author.objects.bulk_create(
+            Author(name=f'Benchmark author {i}', bio='x' * 200) for i in range(max(authors_per_book * 10, 1))
+        )
+        books = Book.objects.bulk_create(
+            Book(title=f'Benchmark book {i}', description='y' * 400, category=category,
+                 total_copies=3, available_copies=3)
+            for i in range(rows)
+        )
+        Through = Book.authors.through
+        Through.objects.bulk_create(
+            Through(book_id=book.pk, author_id=authors[(i + j) % len(authors)].pk)
+            for i, book in enumerate(books)
+            for j in range(authors_per_book)
+        )
+
+    def measure(self, build, rows, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return rows / best
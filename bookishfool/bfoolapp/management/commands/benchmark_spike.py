@@ -0,0 +1,110 @@
+import io
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from bfoolapp.cache import bump_catalogue_version
+from bfoolapp.models import Book
+from bfoolapp.views import BookListAPIView
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate traffic spikes in a scratch database: concurrent identical catalogue requests on a cold '
+        'cache with and without coalescing, then a client polling POST /api/borrow/ against the throttles.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--rounds', type=int, default=10, help='Cold-cache spikes per mode.')
+        parser.add_argument('--seconds', type=float, default=2.0, help='How long the borrow poller runs.')
+
+    def handle(self, *args, **options):
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        logging.disable(logging.WARNING)
+        try:
+            call_command(
+                'generate_data', users=100, authors=options['books'] // 20, books=options['books'],
+                borrows=options['books'], stdout=io.StringIO(),
+            )
+            unthrottled = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+            for coalesce in (False, True):
+                with override_settings(CATALOGUE_COALESCE=coalesce, REST_FRAMEWORK=unthrottled):
+                    builds, elapsed = self.spike(options['concurrency'], options['rounds'])
+                requests = options['concurrency'] * options['rounds']
+                self.stdout.write(
+                    f"coalescing {'on ' if coalesce else 'off'}  {requests} requests in {options['rounds']} "
+                    f"cold spikes: {builds} page builds, {elapsed:.2f}s ({requests / elapsed:,.0f} req/s)"
+                )
+            self.poll_borrow(options['seconds'])
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def spike(self, concurrency, rounds):
+        url = reverse('books') + '?page_size=100&ordering=popular'
+        builds = 0
+        lock = threading.Lock()
+        original = BookListAPIView.list_books
+
+        def counted(view, request):
+            nonlocal builds
+            with lock:
+                builds += 1
+            return original(view, request)
+
+        def worker(gate):
+            client = Client()
+            try:
+                gate.wait()
+                assert client.get(url).status_code == 200
+            finally:
+                connection.close()
+
+        BookListAPIView.list_books = counted
+        elapsed = 0.0
+        try:
+            for _ in range(rounds):
+                bump_catalogue_version()  # every spike hits a cold cache
+                gate = threading.Barrier(concurrency)
+                threads = [threading.Thread(target=worker, args=(gate,)) for _ in range(concurrency)]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed += time.perf_counter() - started
+        finally:
+            BookListAPIView.list_books = original
+        return builds, elapsed
+
+    def poll_borrow(self, seconds):
+        # One user retrying a borrow of a book with no copies left, as fast as it can
+        cache.clear()
+        caches['throttle'].clear()
+        user = User.objects.create(username='spike_poller')
+        book = Book.objects.order_by('id').first()
+        Book.objects.filter(pk=book.pk).update(available_copies=0)
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'})
+        counts = {}
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            status = client.post(reverse('borrow-book'), {'book_id': book.pk}, content_type='application/json').status_code
+            counts[status] = counts.get(status, 0) + 1
+        self.stdout.write(
+            f"borrow poller   {sum(counts.values())} POSTs in {seconds:.1f}s: {counts.get(400, 0)} reached the "
+            f"database, {counts.get(429, 0)} throttled (429)"
+        )
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from bfoolapp.models import Book, Category
+from bfoolapp.services import InventoryError, borrow_book, return_book
+
+
+# What settings.py used before the SQLite profile: rollback journal, full
+# fsync, deferred transactions and Python's default 5 s busy timeout
+PROFILES = {
+    'default': {
+        'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+        'options': {'timeout': 5},
+    },
+    'immediate': {
+        'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+        'options': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+    },
+    'tuned': {
+        'pragmas': None,  # settings.SQLITE_PRAGMAS
+        'options': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure borrow/return write throughput from concurrent threads on SQLite, with the stock '
+        'connection settings and with the tuned profile, in a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--cycles', type=int, default=100, help='Borrow+return cycles per thread.')
+        parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark compares SQLite connection profiles.')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # Lock waits show up as slow BEGINs; the summary lines are the report
+        logging.disable(logging.WARNING)
+        try:
+            category = Category.objects.create(name='Benchmark')
+            self.books = Book.objects.bulk_create(
+                Book(title=f'Book {i}', category=category, total_copies=10**6, available_copies=10**6)
+                for i in range(50)
+            )
+            for name in options['profiles']:
+                counts, elapsed = self.run_profile(PROFILES[name], options['threads'], options['cycles'])
+                self.stdout.write(
+                    f"{name:<10} {counts['ops'] / elapsed:8,.0f} writes/s  {counts['ops']} transactions in "
+                    f"{elapsed:.1f}s, {counts['errors']} failed with \"database is locked\", "
+                    f"{counts['refused']} borrows refused (loans left open by failed returns)"
+                )
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_profile(self, profile, threads, cycles):
+        # Every thread opens its own connection from this (shared) settings dict
+        connection.close()
+        saved_options = dict(connection.settings_dict['OPTIONS'])
+        connection.settings_dict['OPTIONS'] = dict(profile['options'])
+        overrides = {'SQLITE_PRAGMAS': profile['pragmas']} if profile['pragmas'] is not None else {}
+        counts = {'ops': 0, 'errors': 0, 'refused': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            user = users[index]
+            mine = dict.fromkeys(counts, 0)
+            try:
+                for cycle in range(cycles):
+                    book = self.books[(index + cycle) % len(self.books)]
+                    try:
+                        borrow = borrow_book(user, book)
+                        mine['ops'] += 1
+                        return_book(user, borrow)
+                        mine['ops'] += 1
+                    except OperationalError:
+                        mine['errors'] += 1
+                    except InventoryError:
+                        mine['refused'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in mine.items():
+                        counts[key] += value
+
+        with override_settings(**overrides):
+            # Opened alone first, so switching the journal mode doesn't race the workers
+            users = [User.objects.create(username=f'writer_{time.monotonic_ns()}_{i}') for i in range(threads)]
+            connection.close()
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        connection.settings_dict['OPTIONS'] = saved_options
+        connection.close()
+        return counts, elapsed
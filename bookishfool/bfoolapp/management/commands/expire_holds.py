@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bfoolapp.services import HOLD_PICKUP_PERIOD, expire_holds
+
+
+class Command(BaseCommand):
+    help = (
+        f'Release holds not picked up within {HOLD_PICKUP_PERIOD.days} days of becoming ready and pass '
+        'their copies to the next holds in line. Run every few minutes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = expire_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {stats['expired']} hold(s), {stats['reallocated']} copy(ies) passed down the queue, "
+            f"in {time.perf_counter() - started:.2f}s."
+        ))
@@ -0,0 +1,160 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bfoolapp.cache import bump_catalogue_version
+from bfoolapp.models import Author, Book, Borrow, Category, UserProfile
+from bfoolapp.search import rebuild_index
+from bfoolapp.services import LOAN_PERIOD, MAX_ACTIVE_BORROWS, POPULARITY_WINDOW, create_users
+
+
+WORDS = (
+    'shadow river garden silent empire winter glass broken ancient hidden last city night '
+    'stone golden house war song dream fire sea moon letters journey kingdom secret wild'
+).split()
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = 'Load a synthetic library (users, authors, categories, books, borrow history) with bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--authors', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--borrows', type=int, default=20000)
+        parser.add_argument('--active-ratio', type=float, default=0.05,
+                            help='Share of users that currently hold loans.')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent for book popularity; higher means a few titles dominate.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        if connection.vendor == 'sqlite':
+            # Index pages for a million random-order inserts don't fit the default 2 MB cache
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA cache_size = -262144')
+
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            categories = Category.objects.bulk_create(
+                (Category(name=f'{self.phrase(1)} {i}') for i in range(options['categories'])),
+                batch_size=self.batch_size,
+            )
+            authors = Author.objects.bulk_create(
+                (Author(name=f'{self.phrase(2)} {i}', bio=self.phrase(30)) for i in range(options['authors'])),
+                batch_size=self.batch_size,
+            )
+            books = self.create_books(options['books'], categories, authors)
+            loans = self.create_borrows(users, books, options['borrows'], options['active_ratio'], options['skew'])
+
+        rebuild_index(batch_size=self.batch_size)
+        bump_catalogue_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users, {len(authors)} authors, {len(categories)} categories, "
+            f"{len(books)} books and {loans} borrows in {time.perf_counter() - started:.1f}s "
+            f"(password for every user: {PASSWORD!r})."
+        ))
+
+    def phrase(self, words):
+        return ' '.join(self.rng.choices(WORDS, k=words)).title()
+
+    def create_users(self, count):
+        # Hash once: every synthetic user shares the password
+        password = make_password(PASSWORD)
+        prefix = f'bench{int(time.time())}_'
+        return create_users(
+            [User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+
+    def create_books(self, count, categories, authors):
+        books = Book.objects.bulk_create(
+            (
+                Book(
+                    title=self.phrase(self.rng.randint(1, 4))[:100],
+                    description=self.phrase(self.rng.randint(10, 60)),
+                    category=self.rng.choice(categories),
+                    total_copies=(copies := self.rng.randint(1, 10)),
+                    available_copies=copies,
+                )
+                for _ in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        author_ids = [author.pk for author in authors]
+        links = [
+            (book.pk, author_id)
+            for book, per_book in zip(books, self.rng.choices((1, 1, 1, 2, 3), k=len(books)))
+            for author_id in self.rng.sample(author_ids, k=min(len(author_ids), per_book))
+        ]
+        self.insert_rows(Book.authors.through._meta.db_table, ('book_id', 'author_id'), links)
+        return books
+
+    def insert_rows(self, table, columns, rows):
+        # Raw executemany: building a million model instances would dominate the load time
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.batch_size):
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+
+    def create_borrows(self, users, books, count, active_ratio, skew):
+        if not users or not books:
+            return 0
+        today = timezone.now().date()
+        popularity = [1 / (rank + 1) ** skew for rank in range(len(books))]
+        picks = self.rng.choices(books, weights=popularity, k=count)
+        borrowers = self.rng.choices([user.pk for user in users], k=count)
+        ages = self.rng.choices(range(721), k=count)
+        loan_lengths = self.rng.choices(range(1, 21), k=count)
+        days = [today - timedelta(days=age) for age in range(721 + LOAN_PERIOD.days)]
+
+        active_users = {user.pk for user in self.rng.sample(users, k=int(len(users) * active_ratio))}
+        holding = Counter()
+        out = Counter()
+        lifetime = Counter()
+        recent = Counter()
+        rows = []
+        for book, user_id, age, loan_length in zip(picks, borrowers, ages, loan_lengths):
+            lifetime[book.pk] += 1
+            if age < POPULARITY_WINDOW.days:
+                recent[book.pk] += 1
+            returned = None
+            can_hold = user_id in active_users and holding[user_id] < MAX_ACTIVE_BORROWS
+            if can_hold and age < 30 and out[book.pk] < book.total_copies:
+                holding[user_id] += 1
+                out[book.pk] += 1
+            else:
+                returned = days[max(age - loan_length, 0)]
+            rows.append((user_id, book.pk, days[age], today + LOAN_PERIOD - timedelta(days=age), returned))
+        self.insert_rows(
+            Borrow._meta.db_table, ('user_id', 'book_id', 'borrow_date', 'due_date', 'return_date'), rows
+        )
+
+        # Keep the denormalized counters consistent with the history just written
+        borrowed = [book for book in books if lifetime[book.pk]]
+        for book in borrowed:
+            book.available_copies = book.total_copies - out[book.pk]
+            book.borrow_count = lifetime[book.pk]
+            book.recent_borrow_count = recent[book.pk]
+        Book.objects.bulk_update(
+            borrowed, ['available_copies', 'borrow_count', 'recent_borrow_count'], batch_size=self.batch_size
+        )
+        profiles = list(UserProfile.objects.filter(user_id__in=holding))
+        for profile in profiles:
+            profile.active_borrow_count = holding[profile.user_id]
+        UserProfile.objects.bulk_update(profiles, ['active_borrow_count'], batch_size=self.batch_size)
+        return count
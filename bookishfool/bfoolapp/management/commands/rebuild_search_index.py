@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bfoolapp.search import backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalogue search index from scratch, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} book(s) with the {backend()} backend in {time.perf_counter() - started:.1f}s.'
+        ))
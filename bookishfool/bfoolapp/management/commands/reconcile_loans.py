@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from bfoolapp.services import loan_counter_drift, repair_loan_counters
+
+
+class Command(BaseCommand):
+    help = 'Compare UserProfile loan and penalty counters with the Borrow table and the penalty ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite drifted counters from the source tables.')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            loan_counter_drift().values_list(
+                'pk', 'user__username', 'active_borrow_count', 'actual_active', 'penalty_point', 'ledger_points'
+            )
+        )
+        for pk, username, cached_active, actual_active, cached_points, ledger_points in drifted:
+            self.stdout.write(
+                f'{username}: active_borrow_count {cached_active} (actual {actual_active}), '
+                f'penalty_point {cached_points} (ledger {ledger_points})'
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+        elif options['fix']:
+            repair_loan_counters([row[0] for row in drifted])
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} profile(s).'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} profile(s) drifted; re-run with --fix to repair.'))
@@ -0,0 +1,28 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bfoolapp.services import rollup_borrow_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rolling 30-day borrow counts behind ?ordering=popular. Run daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Roll up as of this date (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+
+        started = time.perf_counter()
+        changed = rollup_borrow_counts(today=today, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated the recent borrow count of {changed} book(s) in {time.perf_counter() - started:.2f}s.'
+        ))
@@ -0,0 +1,29 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bfoolapp.services import accrue_overdue_penalties
+
+
+class Command(BaseCommand):
+    help = 'Accrue penalty points for overdue loans. Safe to run more than once a day.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Accrue up to this date (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--user-batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format.')
+
+        started = time.perf_counter()
+        stats = accrue_overdue_penalties(today=today, user_batch_size=options['user_batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Charged {stats['points']} point(s) on {stats['loans']} overdue loan(s) "
+            f"across {stats['due_dates']} due date(s) in {time.perf_counter() - started:.2f}s."
+        ))
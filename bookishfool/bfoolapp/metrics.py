@@ -0,0 +1,71 @@
+"""In-process request metrics, exposed in the Prometheus text format."""
+import threading
+from bisect import bisect_left
+
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # one counter per bucket plus +Inf, then sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+LABELS = ('endpoint', 'method', 'status')
+
+REQUEST_DURATION = Histogram(
+    'bfool_request_duration_seconds', 'Wall time per request.', TIME_BUCKETS, LABELS)
+DB_QUERIES = Histogram(
+    'bfool_request_db_queries', 'Database queries per request.', COUNT_BUCKETS, LABELS)
+DB_DURATION = Histogram(
+    'bfool_request_db_duration_seconds', 'Time spent in database queries per request.', TIME_BUCKETS, LABELS)
+RENDER_DURATION = Histogram(
+    'bfool_request_render_duration_seconds', 'Time spent rendering the response body.', TIME_BUCKETS, LABELS)
+RESPONSE_SIZE = Histogram(
+    'bfool_response_size_bytes', 'Response body size as sent, after compression (streaming responses excluded).',
+    SIZE_BUCKETS, LABELS)
+
+REGISTRY = [REQUEST_DURATION, DB_QUERIES, DB_DURATION, RENDER_DURATION, RESPONSE_SIZE]
+
+
+def expose():
+    return '\n'.join(line for histogram in REGISTRY for line in histogram.expose()) + '\n'
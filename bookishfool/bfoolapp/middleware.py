@@ -0,0 +1,124 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.middleware.gzip import GZipMiddleware
+
+from . import metrics
+
+
+slow_query_logger = logging.getLogger('bfoolapp.slow_queries')
+
+# Stats of the request being handled; the context follows sync_to_async threads
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'render_started', 'render_finished')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_started = None
+        self.render_finished = None
+
+    def rendered(self, response):
+        # Post-render callback: runs as render() returns, before the middleware below
+        # (compression, conditional GET) sees the body
+        self.render_finished = time.perf_counter()
+
+
+def instrument_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        if elapsed * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+            slow_query_logger.warning(
+                'slow query',
+                extra={'duration_ms': round(elapsed * 1000, 2), 'sql': sql, 'many': many},
+            )
+
+
+@receiver(connection_created)
+def install_query_instrumentation(sender, connection, **kwargs):
+    # Every connection, in every thread, so async views' ORM calls are counted too
+    if instrument_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_query)
+
+
+class PerformanceMiddleware:
+    """Record wall time, DB queries/time, render time and response size per endpoint."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    def start(self, request):
+        stats = RequestStats()
+        request._performance_stats = stats
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        stats = request._performance_stats
+        stats.render_started = time.perf_counter()
+        response.add_post_render_callback(stats.rendered)
+        return response
+
+    def finish(self, request, response, stats, started):
+        finished = time.perf_counter()
+        match = request.resolver_match
+        labels = {
+            'endpoint': match.route if match else 'unmatched',
+            'method': request.method,
+            'status': response.status_code,
+        }
+        metrics.REQUEST_DURATION.observe(finished - started, **labels)
+        metrics.DB_QUERIES.observe(stats.queries, **labels)
+        metrics.DB_DURATION.observe(stats.db_time, **labels)
+        if stats.render_finished is not None:
+            metrics.RENDER_DURATION.observe(stats.render_finished - stats.render_started, **labels)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), **labels)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZipMiddleware with a configurable floor: small bodies cost more to compress than they save."""
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bfoolapp', '0003_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrow',
+            name='penalty_accrued_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
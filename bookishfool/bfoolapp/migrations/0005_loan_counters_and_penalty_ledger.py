@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    UserProfile = apps.get_model('bfoolapp', 'UserProfile')
+    Borrow = apps.get_model('bfoolapp', 'Borrow')
+    PenaltyEntry = apps.get_model('bfoolapp', 'PenaltyEntry')
+
+    active = (
+        Borrow.objects.filter(user_id=OuterRef('user_id'), return_date__isnull=True)
+        .order_by().values('user_id').annotate(n=Count('id')).values('n')
+    )
+    UserProfile.objects.update(active_borrow_count=Coalesce(Subquery(active), 0))
+
+    # Existing balances become the opening entry of each user's ledger
+    PenaltyEntry.objects.bulk_create(
+        (
+            PenaltyEntry(user_id=user_id, points=points, reason='opening_balance')
+            for user_id, points in UserProfile.objects.exclude(penalty_point=0).values_list('user_id', 'penalty_point').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bfoolapp', '0004_borrow_penalty_accrued_until'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='active_borrow_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PenaltyEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField()),
+                ('reason', models.CharField(choices=[('overdue', 'Overdue'), ('late_return', 'Late return'), ('opening_balance', 'Opening balance')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('borrow', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bfoolapp.borrow')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='penalty_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def forget_search_backend():
+    # search.backend() caches whether the table exists, per process
+    from bfoolapp.search import forget_backend
+    forget_backend()
+
+
+def create_fts_table(apps, schema_editor):
+    forget_search_backend()
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return  # search.py falls back to the BookSearchTerm index
+        cursor.execute(
+            'CREATE VIRTUAL TABLE bfoolapp_book_fts USING fts5(title, description, authors)'
+        )
+        cursor.execute(
+            """
+            INSERT INTO bfoolapp_book_fts (rowid, title, description, authors)
+            SELECT b.id, b.title, b.description, COALESCE(group_concat(a.name, ' '), '')
+            FROM bfoolapp_book b
+            LEFT JOIN bfoolapp_book_authors ba ON ba.book_id = b.id
+            LEFT JOIN bfoolapp_author a ON a.id = ba.author_id
+            GROUP BY b.id
+            """
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    forget_search_backend()
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS bfoolapp_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bfoolapp', '0005_loan_counters_and_penalty_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('score', models.PositiveIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='bfoolapp.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'book'], name='search_term_book_idx')],
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
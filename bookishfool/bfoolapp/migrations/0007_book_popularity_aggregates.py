@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-18 13:44
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill_borrow_counts(apps, schema_editor):
+    Book = apps.get_model('bfoolapp', 'Book')
+    Borrow = apps.get_model('bfoolapp', 'Borrow')
+
+    def borrows_since(cutoff=None):
+        borrows = Borrow.objects.filter(book_id=OuterRef('pk'))
+        if cutoff:
+            borrows = borrows.filter(borrow_date__gt=cutoff)
+        return Coalesce(Subquery(borrows.order_by().values('book_id').annotate(n=Count('id')).values('n')), 0)
+
+    # Same window as services.POPULARITY_WINDOW
+    cutoff = timezone.now().date() - timedelta(days=30)
+    Book.objects.update(borrow_count=borrows_since(), recent_borrow_count=borrows_since(cutoff))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bfoolapp', '0006_book_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='borrow_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='recent_borrow_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='waitlist_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-recent_borrow_count', '-id'], name='book_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('available_copies__gt', 0)), fields=['id'], name='book_available_idx'),
+        ),
+        migrations.RunPython(backfill_borrow_counts, migrations.RunPython.noop),
+    ]
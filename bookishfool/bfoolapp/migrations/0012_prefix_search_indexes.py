@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:34
+
+import bfoolapp.db
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bfoolapp', '0011_borrow_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='author',
+            name='author_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_title_idx',
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=bfoolapp.db.PrefixIndex(fields=['name'], name='author_name_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=bfoolapp.db.PrefixIndex(fields=['title'], name='book_title_prefix_idx'),
+        ),
+    ]
@@ -1,29 +1,51 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from datetime import timedelta
+from django.db import transaction
 from django.utils import timezone
+from functools import partial
+from .cache import bump_catalogue_version, forget_user
+from .db import PrefixIndex
 
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    penalty_point = models.IntegerField(default=0)  # spelling corrected
+    penalty_point = models.IntegerField(default=0)  # spelling corrected; cached sum of penalty_entries
+    active_borrow_count = models.PositiveIntegerField(default=0)  # maintained by services.py
 
     def __str__(self):
         return f"{self.user.username}'s profile"
 
-# Automatically create or update UserProfile on User creation/update
+# Automatically create a UserProfile for users created one at a time; bulk
+# imports go through services.create_users and stragglers get one lazily
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
-    else:
-        instance.userprofile.save()
+    forget_cached_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    forget_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def forget_user_of_profile(sender, instance, **kwargs):
+    forget_cached_user(instance.user_id)
+
+
+def forget_cached_user(user_id):
+    # After commit, so a concurrent request can't re-cache the old row
+    transaction.on_commit(partial(forget_user, user_id))
 
 
 class Category(models.Model):  # use singular 'Category' as model name
     name = models.CharField(max_length=100)
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)  # upsert key, see ingest.py
 
     def __str__(self):
         return self.name
@@ -32,11 +54,25 @@ class Category(models.Model):  # use singular 'Category' as model name
 class Author(models.Model):  # use singular 'Author' as model name
     name = models.CharField(max_length=100)
     bio = models.TextField(blank=True)
-    
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)  # upsert key, see ingest.py
+
+    class Meta:
+        indexes = [
+            PrefixIndex(fields=['name'], name='author_name_prefix_idx'),  # name__istartswith
+        ]
+
     def __str__(self):
         return self.name
 
 
+class BookQuerySet(models.QuerySet):
+    def with_details(self):
+        # Everything BookSerializer touches: the category FK and the authors m2m
+        return self.select_related('category').prefetch_related(
+            models.Prefetch('authors', queryset=Author.objects.order_by('id'))
+        )
+
+
 class Book(models.Model):  # use singular 'Book' as model name
     title = models.CharField(max_length=100)
     authors = models.ManyToManyField(Author, related_name='books_has_authors')  # fixed reverse relationship
@@ -45,22 +81,249 @@ class Book(models.Model):  # use singular 'Book' as model name
     total_copies = models.PositiveIntegerField()
     available_copies = models.PositiveIntegerField()
     borrows = models.ManyToManyField(User, related_name='borrowed_books', through='Borrow', blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # drives incremental exports
+    # Maintained by services.py; recent_borrow_count is re-based daily by rollup_book_stats
+    borrow_count = models.PositiveIntegerField(default=0)
+    recent_borrow_count = models.PositiveIntegerField(default=0)
+    waitlist_length = models.PositiveIntegerField(default=0)
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)  # upsert key, see ingest.py
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            PrefixIndex(fields=['title'], name='book_title_prefix_idx'),  # title__istartswith
+            # ?ordering=popular: keyset pages over (recent_borrow_count, id)
+            models.Index(fields=['-recent_borrow_count', '-id'], name='book_popular_idx'),
+            # ?available=true: the id-ordered listing restricted to lendable books
+            models.Index(fields=['id'], condition=models.Q(available_copies__gt=0), name='book_available_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+# Any catalogue change invalidates the cached /api/books/ responses, once it
+# commits: bumping earlier lets a concurrent request re-cache the old rows
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_catalogue_on_change(sender, **kwargs):
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def invalidate_catalogue_on_authors_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalogue_version)
+
+    # Keep Book.updated_at honest for incremental exports
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        Book.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif reverse and action in ('post_add', 'post_remove'):
+        Book.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+    elif reverse and action == 'pre_clear':
+        instance.books_has_authors.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Author)
+def touch_books_of_author(sender, instance, created, **kwargs):
+    if not created:
+        instance.books_has_authors.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+def touch_books_of_category(sender, instance, created, **kwargs):
+    if not created:
+        instance.book_set.update(updated_at=timezone.now())
+
+
+class BookSearchTerm(models.Model):
+    # Posting list for the pure-Python search backend (see search.py)
+    term = models.CharField(max_length=64)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_terms')
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'book'], name='search_term_book_idx'),
+        ]
+
+
+# Keep the search index in step with titles, descriptions and author names
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, **kwargs):
+    from .search import index_books
+    index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    from .search import remove_books
+    remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def reindex_books_of_author(sender, instance, created, **kwargs):
+    if not created:
+        from .search import index_books
+        index_books(list(instance.books_has_authors.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Author)
+def remember_books_of_author(sender, instance, **kwargs):
+    # The through rows are gone by post_delete, and no m2m_changed is sent
+    instance._search_book_ids = list(instance.books_has_authors.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def reindex_books_of_deleted_author(sender, instance, **kwargs):
+    from .search import index_books
+    index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def reindex_books_on_authors_change(sender, instance, action, reverse, pk_set, **kwargs):
+    from .search import index_books
+    if not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        index_books([instance.pk])
+    elif reverse and action in ('post_add', 'post_remove'):
+        index_books(list(pk_set))
+    elif reverse and action == 'pre_clear':
+        instance._search_book_ids = list(instance.books_has_authors.values_list('pk', flat=True))
+    elif reverse and action == 'post_clear':
+        index_books(getattr(instance, '_search_book_ids', []))
+
+
+class BorrowQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(return_date__isnull=True)
+
+    def with_details(self):
+        # BorrowSerializer nests UserSerializer and the full BookSerializer
+        return self.select_related('user', 'book__category').prefetch_related(
+            models.Prefetch('book__authors', queryset=Author.objects.order_by('id'))
+        )
+
+
 class Borrow(models.Model):  # use singular 'Borrow'
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     borrow_date = models.DateField(auto_now_add=True)
     due_date = models.DateField()
     return_date = models.DateField(null=True, blank=True)
-    
+    penalty_accrued_until = models.DateField(null=True, blank=True)  # set by the overdue scanner
+
+    objects = BorrowQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Active loans per user: the check on every borrow/return and the loan listing
+            models.Index(fields=['user'], condition=models.Q(return_date__isnull=True), name='borrow_active_user_idx'),
+            # Overdue scans: due_date < today AND return_date IS NULL
+            models.Index(fields=['due_date', 'return_date'], name='borrow_due_return_idx'),
+            # Admin date hierarchy: MIN/MAX for the year links and month/day ranges
+            models.Index(fields=['borrow_date'], name='borrow_date_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.due_date:
             self.due_date = self.borrow_date or (timezone.now().date()) + timedelta(days=14)
         super().save(*args, **kwargs)
 
+    def penalty_due(self, on):
+        # Late days up to `on` that the overdue scanner has not charged yet
+        charged_until = max(self.due_date, self.penalty_accrued_until or self.due_date)
+        return max((on - charged_until).days, 0)
+
     def __str__(self):
         return f"{self.user.username} borrowed {self.book.title}"
+
+
+class ArchivedBorrow(models.Model):
+    """
+    A returned loan moved out of Borrow by services.archive_returned_borrows,
+    keeping its id so loan history reads both tables as one id-ordered list.
+    Penalty entries of archived loans lose their borrow link (SET_NULL).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # covered by archived_borrow_user_idx
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    borrow_date = models.DateField()
+    due_date = models.DateField()
+    return_date = models.DateField()
+
+    class Meta:
+        indexes = [
+            # Loan history: one user's loans by id, newest first
+            models.Index(fields=['user', 'id'], name='archived_borrow_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} borrowed {self.book.title} (archived)"
+
+
+
+class PenaltyEntry(models.Model):
+    # Append-only ledger; UserProfile.penalty_point is its running total
+    OVERDUE = 'overdue'
+    LATE_RETURN = 'late_return'
+    OPENING_BALANCE = 'opening_balance'
+    REASON_CHOICES = [
+        (OVERDUE, 'Overdue'),
+        (LATE_RETURN, 'Late return'),
+        (OPENING_BALANCE, 'Opening balance'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='penalty_entries')
+    borrow = models.ForeignKey(Borrow, on_delete=models.SET_NULL, null=True, blank=True)
+    points = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.points} point(s) for {self.user.username} ({self.reason})"
+
+
+class Hold(models.Model):
+    # A place in one book's queue; returned copies go to the oldest waiting hold (services.py)
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    OPEN = (WAITING, READY)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)  # pickup deadline once ready
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'], condition=models.Q(status__in=['waiting', 'ready']),
+                name='hold_one_open_per_user_book',
+            ),
+        ]
+        indexes = [
+            # Queue order is id order: the head of a book's queue and everyone's position
+            models.Index(fields=['book', 'id'], condition=models.Q(status='waiting'), name='hold_queue_idx'),
+            # Expiry job: ready holds past their pickup deadline
+            models.Index(fields=['expires_at'], condition=models.Q(status='ready'), name='hold_ready_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}'s hold on {self.book.title} ({self.status})"
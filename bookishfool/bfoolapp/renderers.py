@@ -0,0 +1,54 @@
+"""
+JSON encoding for API responses.
+
+settings.JSON_BACKEND picks the encoder: ``orjson`` (several times faster
+than the stdlib on large lists), ``stdlib`` (json + DRF's JSONEncoder) or
+``auto`` (orjson when installed). Both produce the same compact UTF-8
+output, including DRF's 'Z' suffix for UTC datetimes.
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+ORJSON_OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def backend():
+    choice = getattr(settings, 'JSON_BACKEND', 'auto')
+    if choice == 'auto':
+        return 'orjson' if orjson else 'stdlib'
+    if choice == 'orjson' and orjson is None:
+        raise ImproperlyConfigured("JSON_BACKEND is 'orjson' but orjson is not installed.")
+    if choice not in ('orjson', 'stdlib'):
+        raise ImproperlyConfigured(f'Unknown JSON_BACKEND {choice!r}.')
+    return choice
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes."""
+    if backend() == 'orjson':
+        # DRF's encoder covers what orjson doesn't: Decimal, lazy strings, querysets...
+        encoded = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+    else:
+        encoded = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+    # As DRF does, so the output is also valid JavaScript
+    return encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # Pretty printing was asked for; orjson only indents by two
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
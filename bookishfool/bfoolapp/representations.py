@@ -0,0 +1,320 @@
+"""
+Read-only list representations built straight from ``.values()`` rows.
+
+Each function returns exactly what the matching serializer in serializers.py
+would (same keys, same order, same types), without instantiating model
+objects or serializer fields per row. Keep them in sync with the serializers.
+
+Given a Fieldset, they return a sparse version instead, and the matching
+``*_rows()`` select only the columns it needs.
+"""
+from collections import defaultdict
+from itertools import islice
+
+from .models import ArchivedBorrow, Author, Book, Borrow, Category
+
+
+CATEGORY_FIELDS = ('id', 'name')
+AUTHOR_FIELDS = ('id', 'name', 'bio')
+BOOK_FIELDS = (
+    'id', 'title', 'description', 'total_copies', 'available_copies',
+    'category_id', 'category__name',
+)
+BORROW_FIELDS = (
+    'id', 'user_id', 'user__username', 'user__email',
+    'borrow_date', 'due_date', 'return_date',
+) + tuple(f'book__{field}' for field in BOOK_FIELDS)
+HOLD_FIELDS = ('id', 'book_id', 'book__title', 'status', 'created_at', 'ready_at', 'expires_at')
+LOAN_HISTORY_FIELDS = ('id', 'book_id', 'book__title', 'borrow_date', 'due_date', 'return_date')
+
+# Output fields a Fieldset may name, in output order, and the ones it may expand
+AUTHOR_OUTPUT = ('id', 'name', 'bio')
+BOOK_OUTPUT = ('id', 'title', 'description', 'total_copies', 'available_copies', 'authors', 'category')
+BOOK_EXPANDABLE = ('authors',)
+BORROW_OUTPUT = ('id', 'user', 'book', 'borrow_date', 'due_date', 'return_date')
+BORROW_EXPANDABLE = ('user', 'book')
+
+
+class FieldsetError(ValueError):
+    def __init__(self, param, message):
+        super().__init__(message)
+        self.param = param
+
+
+class Fieldset:
+    """
+    The ``?fields=`` and ``?expand=`` of a list request.
+
+    ``fields`` names the fields to return (``id`` always is), all of them if
+    absent. Nested objects named in ``expand`` are returned in full, others
+    shrink to their id and name or title. A request with neither parameter
+    gets the full representation.
+    """
+
+    def __init__(self, fields, expand):
+        self.fields = frozenset(fields) | {'id'}
+        self.expand = frozenset(expand)
+
+    @classmethod
+    def from_query(cls, params, available, expandable=()):
+        """None when the request asks for the full representation."""
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        fields = cls._parse(params, 'fields', available) if 'fields' in params else available
+        expand = cls._parse(params, 'expand', expandable) if 'expand' in params else ()
+        return cls(fields, expand)
+
+    @staticmethod
+    def _parse(params, param, allowed):
+        names = [name.strip() for name in params.get(param, '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise FieldsetError(param, f'Unknown: {", ".join(unknown)}. Choose from: {", ".join(allowed)}.')
+        return names
+
+    def expands(self, field):
+        return field in self.expand
+
+
+def _columns(fieldset, columns, prefix=''):
+    return tuple(prefix + column for field, names in columns.items() if field in fieldset.fields for column in names)
+
+
+BOOK_COLUMNS = {
+    'id': ('id',), 'title': ('title',), 'description': ('description',), 'total_copies': ('total_copies',),
+    'available_copies': ('available_copies',), 'authors': (), 'category': ('category_id', 'category__name'),
+}
+
+
+def category_rows(queryset=None):
+    return (queryset if queryset is not None else Category.objects.all()).values(*CATEGORY_FIELDS)
+
+
+def author_rows(queryset=None, fieldset=None):
+    queryset = queryset if queryset is not None else Author.objects.all()
+    if fieldset is None:
+        return queryset.values(*AUTHOR_FIELDS)
+    return queryset.values(*[field for field in AUTHOR_OUTPUT if field in fieldset.fields])
+
+
+def book_columns(fieldset=None):
+    return BOOK_FIELDS if fieldset is None else _columns(fieldset, BOOK_COLUMNS)
+
+
+def book_rows(queryset=None, fieldset=None):
+    return (queryset if queryset is not None else Book.objects.all()).values(*book_columns(fieldset))
+
+
+def borrow_rows(queryset, fieldset=None):
+    if fieldset is None:
+        return queryset.values(*BORROW_FIELDS)
+    columns = ['id']
+    if 'user' in fieldset.fields:
+        columns += ['user_id', 'user__username'] + (['user__email'] if fieldset.expands('user') else [])
+    if 'book' in fieldset.fields:
+        columns += [f'book__{field}' for field in BOOK_FIELDS] if fieldset.expands('book') else ['book__id', 'book__title']
+    columns += [field for field in ('borrow_date', 'due_date', 'return_date') if field in fieldset.fields]
+    return queryset.values(*columns)
+
+
+def hold_rows(queryset):
+    return queryset.values(*HOLD_FIELDS)
+
+
+def loan_history_rows(user_id, limit, before=None):
+    """
+    A user's newest ``limit`` loans with ids below ``before``, live and
+    archived. Archived loans keep their ids, so a page is the top of both
+    tables merged: two index range scans, whatever the history's length.
+    """
+    rows = []
+    for model, archived in ((Borrow, False), (ArchivedBorrow, True)):
+        queryset = model.objects.filter(user_id=user_id)
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        rows += [{**row, 'archived': archived} for row in queryset.order_by('-id').values(*LOAN_HISTORY_FIELDS)[:limit]]
+    rows.sort(key=lambda row: row['id'], reverse=True)
+    return rows[:limit]
+
+
+def represent_categories(rows):
+    return [{'id': row['id'], 'name': row['name']} for row in rows]
+
+
+def represent_authors(rows, fieldset=None):
+    if fieldset is None:
+        return [{'id': row['id'], 'name': row['name'], 'bio': row['bio']} for row in rows]
+    fields = [field for field in AUTHOR_OUTPUT if field in fieldset.fields]
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def book_author_rows(book_ids, bio=True):
+    return (
+        Book.authors.through.objects.filter(book_id__in=book_ids)
+        .order_by('book_id', 'author_id')
+        .values_list('book_id', 'author_id', 'author__name', *(['author__bio'] if bio else []))
+    )
+
+
+def group_authors(rows):
+    # Author dicts are shared between books; rows come with or without the bio
+    authors = {}
+    by_book = defaultdict(list)
+    for book_id, author_id, name, *bio in rows:
+        author = authors.get(author_id)
+        if author is None:
+            author = authors[author_id] = {'id': author_id, 'name': name}
+            if bio:
+                author['bio'] = bio[0]
+        by_book[book_id].append(author)
+    return by_book
+
+
+def authors_by_book(book_ids, bio=True):
+    return group_authors(book_author_rows(book_ids, bio))
+
+
+def _category(row, categories, prefix):
+    category_id = row[prefix + 'category_id']
+    category = categories.get(category_id)
+    if category is None:
+        category = categories[category_id] = {'id': category_id, 'name': row[prefix + 'category__name']}
+    return category
+
+
+def _book(row, authors, categories, prefix=''):
+    book_id = row[prefix + 'id']
+    return {
+        'id': book_id,
+        'title': row[prefix + 'title'],
+        'description': row[prefix + 'description'],
+        'total_copies': row[prefix + 'total_copies'],
+        'available_copies': row[prefix + 'available_copies'],
+        'authors': authors.get(book_id, []),
+        'category': _category(row, categories, prefix),
+    }
+
+
+def _sparse_book(row, authors, categories, fields):
+    book = {'id': row['id']}
+    for field in ('title', 'description', 'total_copies', 'available_copies'):
+        if field in fields:
+            book[field] = row[field]
+    if 'authors' in fields:
+        book['authors'] = authors.get(book['id'], [])
+    if 'category' in fields:
+        book['category'] = _category(row, categories, '')
+    return book
+
+
+def book_authors_wanted(fieldset):
+    """(fetch authors at all, with their bio) for a book listing."""
+    if fieldset is None:
+        return True, True
+    return 'authors' in fieldset.fields, fieldset.expands('authors')
+
+
+def represent_books(rows, authors=None, fieldset=None):
+    rows = list(rows)
+    wanted, bio = book_authors_wanted(fieldset)
+    if authors is None and wanted:
+        authors = authors_by_book([row['id'] for row in rows], bio)
+    categories = {}
+    if fieldset is None:
+        return [_book(row, authors, categories) for row in rows]
+    return [_sparse_book(row, authors or {}, categories, fieldset.fields) for row in rows]
+
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+
+def borrow_authors_wanted(fieldset):
+    # Only a fully expanded book lists its authors
+    return fieldset is None or ('book' in fieldset.fields and fieldset.expands('book'))
+
+
+def represent_borrows(rows, authors=None, fieldset=None):
+    rows = list(rows)
+    if authors is None and borrow_authors_wanted(fieldset):
+        authors = authors_by_book({row['book__id'] for row in rows})
+    categories = {}
+    if fieldset is None:
+        return [
+            {
+                'id': row['id'],
+                'user': {'id': row['user_id'], 'username': row['user__username'], 'email': row['user__email']},
+                'book': _book(row, authors, categories, prefix='book__'),
+                'borrow_date': _date(row['borrow_date']),
+                'due_date': _date(row['due_date']),
+                'return_date': _date(row['return_date']),
+            }
+            for row in rows
+        ]
+
+    fields = fieldset.fields
+    loans = []
+    for row in rows:
+        loan = {'id': row['id']}
+        if 'user' in fields:
+            loan['user'] = {'id': row['user_id'], 'username': row['user__username']}
+            if fieldset.expands('user'):
+                loan['user']['email'] = row['user__email']
+        if 'book' in fields:
+            if fieldset.expands('book'):
+                loan['book'] = _book(row, authors, categories, prefix='book__')
+            else:
+                loan['book'] = {'id': row['book__id'], 'title': row['book__title']}
+        for field in ('borrow_date', 'due_date', 'return_date'):
+            if field in fields:
+                loan[field] = _date(row[field])
+        loans.append(loan)
+    return loans
+
+
+def represent_loan_history(rows):
+    return [
+        {
+            'id': row['id'],
+            'book': {'id': row['book_id'], 'title': row['book__title']},
+            'borrow_date': _date(row['borrow_date']),
+            'due_date': _date(row['due_date']),
+            'return_date': _date(row['return_date']),
+            'archived': row['archived'],
+        }
+        for row in rows
+    ]
+
+
+def _datetime(value):
+    # DRF's DateTimeField renders UTC as 'Z'
+    if value is None:
+        return None
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def represent_holds(rows, positions):
+    """``positions``: queue position by hold id, from services.hold_positions()."""
+    return [
+        {
+            'id': row['id'],
+            'book': {'id': row['book_id'], 'title': row['book__title']},
+            'status': row['status'],
+            'position': positions.get(row['id']),
+            'created_at': _datetime(row['created_at']),
+            'ready_at': _datetime(row['ready_at']),
+            'expires_at': _datetime(row['expires_at']),
+        }
+        for row in rows
+    ]
+
+
+def export_book_chunks(queryset, chunk_size):
+    """Yield lists of book dicts (plus ``updated_at``) one chunk at a time."""
+    rows = queryset.order_by('id').values(*BOOK_FIELDS, 'updated_at').iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        books = represent_books(chunk)
+        for book, row in zip(books, chunk):
+            book['updated_at'] = row['updated_at'].isoformat()
+        yield books
@@ -0,0 +1,160 @@
+"""
+Catalogue search over book titles, descriptions and author names.
+
+Two interchangeable backends, picked by settings.SEARCH_BACKEND:
+
+* ``fts5``   - an SQLite FTS5 virtual table ranked with bm25()
+* ``python`` - an inverted index (BookSearchTerm rows) tokenized in Python,
+               which works on any database
+
+``auto`` uses FTS5 when the table exists (migration 0006 creates it when the
+SQLite build supports it) and the Python index otherwise.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+
+from .models import Book, BookSearchTerm
+
+
+FTS_TABLE = 'bfoolapp_book_fts'
+# Relative weight of a hit in each field; FTS5 gets the same weights via bm25()
+FIELD_WEIGHTS = {'title': 10, 'description': 1, 'authors': 5}
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+@lru_cache(maxsize=None)
+def _fts_table_exists(database_name):
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def forget_backend():
+    """Drop the cached FTS5 table check; call after creating or dropping the table."""
+    _fts_table_exists.cache_clear()
+
+
+def backend():
+    choice = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if choice == 'auto':
+        return 'fts5' if _fts_table_exists(str(connection.settings_dict['NAME'])) else 'python'
+    return choice
+
+
+def _documents(book_ids):
+    documents = {
+        row['id']: {'title': row['title'], 'description': row['description'], 'authors': []}
+        for row in Book.objects.filter(pk__in=book_ids).values('id', 'title', 'description')
+    }
+    names = Book.authors.through.objects.filter(book_id__in=documents).values_list('book_id', 'author__name')
+    for book_id, name in names:
+        documents[book_id]['authors'].append(name)
+    for document in documents.values():
+        document['authors'] = ' '.join(document['authors'])
+    return documents
+
+
+def remove_books(book_ids, chunk_size=2000):
+    book_ids = list(book_ids)
+    fts5 = backend() == 'fts5'
+    # Chunked like ingest._chunks: one IN list per chunk stays under the query parameter limit
+    for start in range(0, len(book_ids), chunk_size):
+        chunk = book_ids[start:start + chunk_size]
+        if fts5:
+            placeholders = ', '.join(['%s'] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', chunk)
+        else:
+            BookSearchTerm.objects.filter(book_id__in=chunk).delete()
+
+
+def index_books(book_ids, replace=True):
+    book_ids = list(book_ids)
+    if not book_ids:
+        return
+    if replace:
+        remove_books(book_ids)
+    documents = _documents(book_ids)
+
+    if backend() == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, authors) VALUES (%s, %s, %s, %s)',
+                [(book_id, d['title'], d['description'], d['authors']) for book_id, d in documents.items()],
+            )
+        return
+
+    postings = []
+    for book_id, document in documents.items():
+        scores = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(document[field]):
+                scores[term] += weight
+        postings.extend(BookSearchTerm(term=term, book_id=book_id, score=score) for term, score in scores.items())
+    BookSearchTerm.objects.bulk_create(postings, batch_size=1000)
+
+
+def rebuild_index(batch_size=2000):
+    forget_backend()  # the table may have been created or dropped since the last check
+    if backend() == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    else:
+        BookSearchTerm.objects.all().delete()
+
+    indexed = 0
+    book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        # One transaction per batch; in autocommit SQLite would sync every row
+        with transaction.atomic():
+            index_books(batch, replace=False)
+        indexed += len(batch)
+    return indexed
+
+
+def search_books(query, limit, offset=0):
+    """Return the ids of matching books, best match first. Every word must match; the last one as a prefix."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+
+    if backend() == 'fts5':
+        match = ' '.join(f'"{term}"' for term in terms) + '*'
+        weights = ', '.join(str(float(FIELD_WEIGHTS[field])) for field in ('title', 'description', 'authors'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid LIMIT %s OFFSET %s',
+                [match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    *whole, prefix = terms
+    # A repeated word is one condition, as in FTS5; a word that is also the prefix satisfies both
+    whole = list(dict.fromkeys(whole))
+    # Number each posting by the query word it satisfies, then keep books that satisfy all of them
+    words = [When(term=term, then=Value(i)) for i, term in enumerate(whole)]
+    wanted = Q(term__in=whole)
+    if prefix not in whole:
+        # A range instead of LIKE 'prefix%' so the (term, book) index is used
+        starts_with = Q(term__gte=prefix, term__lt=prefix + '\U0010ffff')
+        words.append(When(starts_with, then=Value(len(whole))))
+        wanted |= starts_with
+    matched_word = Case(*words, output_field=IntegerField())
+    return list(
+        BookSearchTerm.objects.filter(wanted)
+        .values('book_id')
+        .annotate(words=Count(matched_word, distinct=True), rank=Sum('score'))
+        .filter(words=len(words))
+        .order_by('-rank', 'book_id')
+        .values_list('book_id', flat=True)[offset:offset + limit]
+    )
@@ -2,7 +2,8 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, Category, Author, Book, Borrow
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .models import UserProfile, Category, Author, Book, Borrow, Hold
 # from .models import Post
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -22,6 +23,15 @@ class RegisterSerializer(serializers.ModelSerializer):
     
 
 
+class LibraryTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        return token
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -97,3 +107,60 @@ class BorrowSerializer(serializers.ModelSerializer):
             'due_date',
             'return_date'
         ]
+
+
+class BulkBorrowSerializer(serializers.Serializer):
+    book_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=50)
+
+
+class BulkReturnSerializer(serializers.Serializer):
+    borrow_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=50)
+
+
+class HoldBookSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ['id', 'title']
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book = HoldBookSerializer(read_only=True)
+    position = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Hold
+        fields = ['id', 'book', 'status', 'position', 'created_at', 'ready_at', 'expires_at']
+
+    def get_position(self, hold):
+        return self.context.get('positions', {}).get(hold.pk)
+
+
+# Bulk ingestion items (ingest.py). Plain serializers: a ModelSerializer would
+# add a per-row query for the unique external_id and for every related id.
+class CategoryIngestSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    external_id = serializers.CharField(max_length=64, required=False)
+    name = serializers.CharField(max_length=100)
+
+
+class AuthorIngestSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    external_id = serializers.CharField(max_length=64, required=False)
+    name = serializers.CharField(max_length=100)
+    bio = serializers.CharField(allow_blank=True, required=False)
+
+
+class BookIngestSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    external_id = serializers.CharField(max_length=64, required=False)
+    title = serializers.CharField(max_length=100)
+    description = serializers.CharField(allow_blank=True, required=False)
+    total_copies = serializers.IntegerField(min_value=0)
+    available_copies = serializers.IntegerField(min_value=0)
+    category_id = serializers.IntegerField()
+    author_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+
+class BulkIngestSerializer(serializers.Serializer):
+    # Items are validated one by one in ingest.py, so that bad rows don't reject the batch
+    items = serializers.ListField(allow_empty=False, max_length=10000)
@@ -0,0 +1,461 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, Greatest, Now, RowNumber
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .models import ArchivedBorrow, Book, Borrow, Hold, PenaltyEntry, UserProfile
+
+
+MAX_ACTIVE_BORROWS = 3
+LOAN_PERIOD = timedelta(days=14)
+POPULARITY_WINDOW = timedelta(days=30)  # Book.recent_borrow_count
+ARCHIVE_AFTER = timedelta(days=90)  # returned loans older than this leave the Borrow table
+HOLD_PICKUP_PERIOD = timedelta(days=3)
+
+
+class InventoryError(Exception):
+    pass
+
+
+class NoCopiesAvailable(InventoryError):
+    pass
+
+
+def _per_row(deltas, key='pk'):
+    # One CASE expression so a whole batch of rows is adjusted in a single UPDATE
+    return Case(
+        *[When(**{key: row_id}, then=Value(delta)) for row_id, delta in deltas.items()],
+        default=Value(0),
+    )
+
+
+def catalogue_changed():
+    # Inventory is adjusted with queryset.update(), which sends no signals
+    transaction.on_commit(bump_catalogue_version)
+
+
+def lock_profile(user):
+    # Serializes all inventory mutations of one user (the borrow limit is per user).
+    # Users imported in bulk without a profile get one on first use.
+    return UserProfile.objects.select_for_update().get_or_create(user=user)[0]
+
+
+def release_slots(user, count):
+    # Clamped at zero: a counter that has drifted low (loans created outside this
+    # module, until reconcile_loans repairs it) must not make the return fail
+    UserProfile.objects.filter(user=user).update(
+        active_borrow_count=Greatest(F('active_borrow_count') - count, 0)
+    )
+
+
+def create_users(users, batch_size=None):
+    """bulk_create ``users`` and their profiles; bulk_create sends no post_save."""
+    users = User.objects.bulk_create(users, batch_size=batch_size)
+    if users and users[0].pk is None:
+        # Backends that can't return ids from a bulk insert
+        names = [user.username for user in users]
+        ids = {}
+        for start in range(0, len(names), 900):
+            ids.update(User.objects.filter(username__in=names[start:start + 900]).values_list('username', 'pk'))
+        for user in users:
+            user.pk = ids[user.username]
+    UserProfile.objects.bulk_create((UserProfile(user=user) for user in users), batch_size=batch_size)
+    return users
+
+
+def charge_penalties(entries):
+    # Append to the ledger and move the cached totals in the same transaction
+    entries = [entry for entry in entries if entry.points]
+    if not entries:
+        return
+    PenaltyEntry.objects.bulk_create(entries)
+    totals = Counter()
+    for entry in entries:
+        totals[entry.user_id] += entry.points
+    UserProfile.objects.filter(user_id__in=totals).update(
+        penalty_point=F('penalty_point') + _per_row(totals, key='user_id')
+    )
+
+
+def borrow_book(user, book):
+    today = timezone.now().date()
+    with transaction.atomic():
+        # Checking the limit and claiming the slot is one conditional UPDATE
+        slot = UserProfile.objects.filter(user=user, active_borrow_count__lt=MAX_ACTIVE_BORROWS)
+        claimed = slot.update(active_borrow_count=F('active_borrow_count') + 1)
+        if not claimed and UserProfile.objects.get_or_create(user=user)[1]:
+            claimed = slot.update(active_borrow_count=F('active_borrow_count') + 1)
+        if not claimed:
+            raise InventoryError(f'You can only borrow up to {MAX_ACTIVE_BORROWS} books at a time.')
+
+        # A copy allocated to the user's hold is already off the shelf
+        from_hold = Hold.objects.filter(user=user, book=book, status=Hold.READY).update(status=Hold.FULFILLED)
+        books = Book.objects.filter(pk=book.pk)
+        if not from_hold:
+            # Decrement in SQL so concurrent borrowers can never oversell a title
+            books = books.filter(available_copies__gt=0)
+        taken = books.update(
+            available_copies=F('available_copies') - (0 if from_hold else 1),
+            borrow_count=F('borrow_count') + 1,
+            recent_borrow_count=F('recent_borrow_count') + 1,
+            updated_at=Now(),
+        )
+        if not taken:
+            raise NoCopiesAvailable('No available copies to borrow.')
+        catalogue_changed()
+
+        return Borrow.objects.create(
+            user=user,
+            book=book,
+            borrow_date=today,
+            due_date=today + LOAN_PERIOD,
+        )
+
+
+def return_book(user, borrow):
+    today = timezone.now().date()
+    with transaction.atomic():
+        lock_profile(user)
+
+        # Only the request that flips return_date may restock the copy
+        returned = Borrow.objects.filter(pk=borrow.pk, return_date__isnull=True).update(return_date=today)
+        if not returned:
+            raise InventoryError('Book already returned.')
+        borrow.refresh_from_db(fields=['due_date', 'return_date', 'penalty_accrued_until'])
+        release_slots(user, 1)
+        hand_back_copies({borrow.book_id: 1})
+
+        late_days = borrow.penalty_due(today)
+        charge_penalties([
+            PenaltyEntry(user=user, borrow=borrow, points=late_days, reason=PenaltyEntry.LATE_RETURN)
+        ])
+        return late_days
+
+
+def bulk_borrow_books(user, book_ids):
+    today = timezone.now().date()
+    results = []
+    with transaction.atomic():
+        slots = MAX_ACTIVE_BORROWS - lock_profile(user).active_borrow_count
+        books = Book.objects.select_for_update().in_bulk(set(book_ids))
+        held = set(
+            Hold.objects.filter(user=user, book_id__in=books, status=Hold.READY).values_list('book_id', flat=True)
+        )
+
+        taken = Counter()
+        from_shelf = Counter()
+        to_create = []
+        for book_id in book_ids:
+            book = books.get(book_id)
+            if book is None:
+                results.append({'book_id': book_id, 'error': 'Book not found.'})
+            elif len(to_create) >= slots:
+                results.append({'book_id': book_id, 'error': f'You can only borrow up to {MAX_ACTIVE_BORROWS} books at a time.'})
+            elif book_id in held and not taken[book_id]:
+                taken[book_id] += 1  # the copy allocated to the user's hold
+                borrow = Borrow(user=user, book=book, borrow_date=today, due_date=today + LOAN_PERIOD)
+                to_create.append(borrow)
+                results.append({'book_id': book_id, 'borrow': borrow})
+            elif book.available_copies - from_shelf[book_id] < 1:
+                results.append({'book_id': book_id, 'error': 'No available copies to borrow.'})
+            else:
+                taken[book_id] += 1
+                from_shelf[book_id] += 1
+                borrow = Borrow(user=user, book=book, borrow_date=today, due_date=today + LOAN_PERIOD)
+                to_create.append(borrow)
+                results.append({'book_id': book_id, 'borrow': borrow})
+
+        if to_create:
+            # The rows read above are only locked where the database has row locks: every
+            # write re-checks its condition, like borrow_book, and a lost race undoes the batch
+            claimed = UserProfile.objects.filter(
+                user=user, active_borrow_count__lte=MAX_ACTIVE_BORROWS - len(to_create)
+            ).update(active_borrow_count=F('active_borrow_count') + len(to_create))
+            if not claimed:
+                raise InventoryError(f'You can only borrow up to {MAX_ACTIVE_BORROWS} books at a time.')
+            collect = held & set(taken)
+            fulfilled = Hold.objects.filter(user=user, book_id__in=collect, status=Hold.READY).update(
+                status=Hold.FULFILLED
+            )
+            stocked = Book.objects.filter(pk__in=taken, available_copies__gte=_per_row(from_shelf)).update(
+                available_copies=F('available_copies') - _per_row(from_shelf),
+                borrow_count=F('borrow_count') + _per_row(taken),
+                recent_borrow_count=F('recent_borrow_count') + _per_row(taken),
+                updated_at=Now(),
+            )
+            if fulfilled != len(collect) or stocked != len(taken):
+                raise NoCopiesAvailable('No available copies to borrow.')
+            Borrow.objects.bulk_create(to_create)
+            catalogue_changed()
+
+    for result in results:
+        borrow = result.pop('borrow', None)
+        if borrow is not None:
+            result.update({'borrow_id': borrow.pk, 'due_date': borrow.due_date})
+    return results
+
+
+def bulk_return_books(user, borrow_ids):
+    today = timezone.now().date()
+    results = []
+    with transaction.atomic():
+        lock_profile(user)
+        borrows = Borrow.objects.select_for_update().filter(user=user).in_bulk(set(borrow_ids))
+
+        restock = Counter()
+        returned = []
+        penalties = []
+        for borrow_id in borrow_ids:
+            borrow = borrows.get(borrow_id)
+            if borrow is None:
+                results.append({'borrow_id': borrow_id, 'error': 'Borrow not found.'})
+            elif borrow.return_date:
+                results.append({'borrow_id': borrow_id, 'error': 'Book already returned.'})
+            else:
+                borrow.return_date = today
+                late_days = borrow.penalty_due(today)
+                penalties.append(PenaltyEntry(
+                    user=user, borrow=borrow, points=late_days, reason=PenaltyEntry.LATE_RETURN
+                ))
+                restock[borrow.book_id] += 1
+                returned.append(borrow.pk)
+                results.append({'borrow_id': borrow_id, 'penalty_points': late_days})
+
+        if returned:
+            Borrow.objects.filter(pk__in=returned).update(return_date=today)
+            release_slots(user, len(returned))
+            hand_back_copies(restock)
+        charge_penalties(penalties)
+    return results
+
+
+def allocate_to_holds(copies):
+    """
+    Give ``copies`` (book_id -> count) to the oldest waiting holds; returns
+    the allocations per book.
+
+    No row locks: the heads come from hold_queue_idx and each is claimed
+    with a conditional UPDATE, so a hold cancelled in the meantime is
+    skipped and the copy goes to the next in line.
+    """
+    allocated = Counter()
+    while True:
+        wanted = {book_id: count - allocated[book_id] for book_id, count in copies.items() if count > allocated[book_id]}
+        if not wanted:
+            return allocated
+        heads = (
+            Hold.objects.filter(book_id__in=wanted, status=Hold.WAITING)
+            .annotate(place=Window(RowNumber(), partition_by=[F('book_id')], order_by=F('id').asc()))
+            .filter(place__lte=max(wanted.values()))
+            .values_list('pk', 'book_id', 'place')
+        )
+        chosen = {pk: book_id for pk, book_id, place in heads if place <= wanted[book_id]}
+        if not chosen:
+            return allocated
+
+        now = timezone.now()
+        claimed = Hold.objects.filter(pk__in=chosen, status=Hold.WAITING).update(
+            status=Hold.READY, ready_at=now, expires_at=now + HOLD_PICKUP_PERIOD
+        )
+        if claimed == len(chosen):
+            allocated.update(chosen.values())
+            continue
+        # Lost a race with a cancellation; ready_at marks the holds this call claimed
+        allocated.update(
+            Hold.objects.filter(pk__in=chosen, status=Hold.READY, ready_at=now).values_list('book_id', flat=True)
+        )
+
+
+def hand_back_copies(copies):
+    """Returned or released copies (book_id -> count): holds first, the shelf gets the rest."""
+    allocated = allocate_to_holds(copies)
+    shelved = {book_id: count - allocated[book_id] for book_id, count in copies.items()}
+    Book.objects.filter(pk__in=copies).update(
+        available_copies=F('available_copies') + _per_row(shelved),
+        waitlist_length=F('waitlist_length') - _per_row(allocated),
+        updated_at=Now(),
+    )
+    catalogue_changed()
+    return allocated
+
+
+def place_hold(user, book):
+    with transaction.atomic():
+        # Only titles with nothing on the shelf can be queued for
+        queued = Book.objects.filter(pk=book.pk, available_copies=0).update(
+            waitlist_length=F('waitlist_length') + 1
+        )
+        if not queued:
+            raise InventoryError('Copies are available; borrow the book instead.')
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(user=user, book=book)
+        except IntegrityError:
+            raise InventoryError('You already have a hold on this book.')
+        catalogue_changed()
+        return hold
+
+
+def cancel_hold(user, hold):
+    # Conditional on the status too: a return may make the hold ready meanwhile
+    holds = Hold.objects.filter(pk=hold.pk, user=user)
+    with transaction.atomic():
+        if holds.filter(status=Hold.READY).update(status=Hold.CANCELLED):
+            # The copy set aside for this hold goes to the next in line
+            hand_back_copies({hold.book_id: 1})
+        elif holds.filter(status=Hold.WAITING).update(status=Hold.CANCELLED):
+            Book.objects.filter(pk=hold.book_id).update(waitlist_length=F('waitlist_length') - 1)
+            catalogue_changed()
+        else:
+            raise InventoryError('Hold is no longer open.')
+
+
+def hold_positions(hold_ids):
+    """Queue position (1 = next) of each waiting hold among ``hold_ids``."""
+    ahead = Hold.objects.filter(
+        book_id=OuterRef('book_id'), status=Hold.WAITING, pk__lt=OuterRef('pk')
+    ).order_by().values('book_id').annotate(n=Count('id')).values('n')
+    return dict(
+        Hold.objects.filter(pk__in=hold_ids, status=Hold.WAITING)
+        .annotate(ahead=Coalesce(Subquery(ahead), 0))
+        .values_list('pk', F('ahead') + 1)
+    )
+
+
+def expire_holds(now=None, batch_size=500):
+    """Release ready holds that were not picked up in time, passing each copy down the queue."""
+    now = now or timezone.now()
+    stats = {'expired': 0, 'reallocated': 0}
+    while True:
+        with transaction.atomic():
+            # Locked until the copies are released (on SQLite, BEGIN IMMEDIATE already keeps
+            # other writers out): a hold collected or cancelled after an unlocked read would
+            # still be expired here and its copy handed out a second time
+            batch = list(
+                Hold.objects.select_for_update().filter(status=Hold.READY, expires_at__lte=now)
+                .order_by('expires_at').values_list('pk', 'book_id')[:batch_size]
+            )
+            if not batch:
+                return stats
+            Hold.objects.filter(pk__in=[pk for pk, _ in batch], status=Hold.READY).update(status=Hold.EXPIRED)
+            allocated = hand_back_copies(Counter(book_id for _, book_id in batch))
+        stats['expired'] += len(batch)
+        stats['reallocated'] += sum(allocated.values())
+
+
+def accrue_overdue_penalties(today=None, user_batch_size=500):
+    """
+    Charge penalty points for every overdue active loan up to ``today``.
+
+    Loans are processed one due date at a time over borrow_due_return_idx.
+    Each loan records how far it has been charged (penalty_accrued_until),
+    so re-running on the same day is a no-op and returns only charge the rest.
+    """
+    today = today or timezone.now().date()
+    overdue = Borrow.objects.active().filter(due_date__lt=today)
+    due_dates = overdue.order_by('due_date').values_list('due_date', flat=True).distinct()
+    stats = {'due_dates': 0, 'loans': 0, 'points': 0}
+
+    for due_date in due_dates.iterator():
+        with transaction.atomic():
+            batch = overdue.filter(due_date=due_date).exclude(penalty_accrued_until__gte=today)
+            groups = (
+                batch.order_by()
+                .values('user_id', 'penalty_accrued_until')
+                .annotate(loans=Count('id'))
+            )
+            points = Counter()
+            for group in groups.iterator():
+                charged_until = max(due_date, group['penalty_accrued_until'] or due_date)
+                points[group['user_id']] += group['loans'] * (today - charged_until).days
+                stats['loans'] += group['loans']
+
+            user_ids = list(points)
+            for start in range(0, len(user_ids), user_batch_size):
+                charge_penalties(
+                    PenaltyEntry(user_id=user_id, points=points[user_id], reason=PenaltyEntry.OVERDUE)
+                    for user_id in user_ids[start:start + user_batch_size]
+                )
+            batch.update(penalty_accrued_until=today)
+
+        stats['due_dates'] += 1
+        stats['points'] += sum(points.values())
+    return stats
+
+
+def rollup_borrow_counts(today=None, batch_size=500):
+    """
+    Re-base Book.recent_borrow_count on the borrows of the last POPULARITY_WINDOW.
+
+    Borrowing only ever increments the count; this daily job drops the
+    borrows that aged out. It reads the Borrow table once (about a second per
+    million rows on SQLite) and writes only the books whose count changed.
+    """
+    today = today or timezone.now().date()
+    with transaction.atomic():
+        recent = dict(
+            Borrow.objects.filter(borrow_date__gt=today - POPULARITY_WINDOW)
+            .order_by().values('book_id').annotate(n=Count('id')).values_list('book_id', 'n')
+        )
+        changed = {
+            book_id: recent.get(book_id, 0)
+            for book_id, count in Book.objects.values_list('pk', 'recent_borrow_count').iterator(chunk_size=10_000)
+            if recent.get(book_id, 0) != count
+        }
+        book_ids = list(changed)
+        for start in range(0, len(book_ids), batch_size):
+            batch = {book_id: changed[book_id] for book_id in book_ids[start:start + batch_size]}
+            Book.objects.filter(pk__in=batch).update(recent_borrow_count=_per_row(batch))
+        if changed:
+            catalogue_changed()
+    return len(changed)
+
+
+def archive_returned_borrows(today=None, keep=ARCHIVE_AFTER, batch_size=1000):
+    """
+    Move loans returned more than ``keep`` ago from Borrow to ArchivedBorrow.
+
+    One transaction per batch, oldest ids first, so the job can be stopped
+    and rerun at any point and never holds the write lock for long.
+    """
+    if keep < POPULARITY_WINDOW:
+        # rollup_borrow_counts only reads the Borrow table
+        raise ValueError(f'Loans must stay unarchived for at least {POPULARITY_WINDOW.days} days.')
+    cutoff = (today or timezone.now().date()) - keep
+    fields = ('id', 'user_id', 'book_id', 'borrow_date', 'due_date', 'return_date')
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Borrow.objects.select_for_update().filter(return_date__lt=cutoff)
+                .order_by('id').values_list(*fields)[:batch_size]
+            )
+            if not rows:
+                return archived
+            ArchivedBorrow.objects.bulk_create(ArchivedBorrow(**dict(zip(fields, row))) for row in rows)
+            Borrow.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        archived += len(rows)
+
+
+def loan_counter_drift():
+    """Profiles whose cached counters disagree with the Borrow table or the penalty ledger."""
+    actual_active = Borrow.objects.active().filter(user_id=OuterRef('user_id')).order_by().values('user_id')
+    ledger = PenaltyEntry.objects.filter(user_id=OuterRef('user_id')).order_by().values('user_id')
+    return UserProfile.objects.annotate(
+        actual_active=Coalesce(Subquery(actual_active.annotate(n=Count('id')).values('n')), 0),
+        ledger_points=Coalesce(Subquery(ledger.annotate(total=Sum('points')).values('total')), 0),
+    ).exclude(active_borrow_count=F('actual_active'), penalty_point=F('ledger_points'))
+
+
+def repair_loan_counters(profile_ids):
+    drifted = loan_counter_drift().filter(pk__in=profile_ids)
+    with transaction.atomic():
+        for profile in drifted.select_for_update():
+            UserProfile.objects.filter(pk=profile.pk).update(
+                active_borrow_count=profile.actual_active, penalty_point=profile.ledger_points
+            )
@@ -0,0 +1,94 @@
+"""Admin changelist tags for tables too large for Django's own queries."""
+from datetime import date
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+def date_span(queryset, field_name):
+    """The first and last date in ``queryset``: two seeks on the field's index."""
+    column = queryset.exclude(**{f'{field_name}__isnull': True}).values_list(field_name, flat=True)
+    return column.order_by(field_name).first(), column.order_by(f'-{field_name}').first()
+
+
+def _next_period(day, kind):
+    if kind == 'year':
+        return day.replace(year=day.year + 1)
+    if kind == 'month':
+        return day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+    return date.fromordinal(day.toordinal() + 1)
+
+
+def periods(first, last, kind):
+    """Every year, month or day from ``first`` to ``last``, including any with no rows."""
+    if first is None:
+        return []
+    period = first.replace(month=1, day=1) if kind == 'year' else first.replace(day=1) if kind == 'month' else first
+    result = []
+    while period <= last:
+        result.append(period)
+        period = _next_period(period, kind)
+    return result
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def period_date_hierarchy(cl):
+    """
+    Django's date_hierarchy for a DateField, without its queries over the
+    whole table: MIN() and MAX() in one aggregate, which SQLite runs as a
+    scan, and a DISTINCT over every row for the choices. The first and last
+    dates are two index seeks instead, and the choices every period between.
+    """
+    field_name = cl.date_hierarchy
+    year_field, month_field, day_field = (f'{field_name}__{part}' for part in ('year', 'month', 'day'))
+    year, month, day = (cl.params.get(name) for name in (year_field, month_field, day_field))
+    if year and month and day:
+        return date_hierarchy(cl)  # a single day: no queries
+
+    def link(filters):
+        return cl.get_query_string(filters, [f'{field_name}__'])
+
+    first, last = date_span(cl.queryset, field_name)
+    if not (year or month or day) and first is not None and first.year == last.year:
+        # Start where Django would: at the only year, or the only month
+        year = first.year
+        if first.month == last.month:
+            month = first.month
+
+    if year and month:
+        return {
+            'show': True,
+            'back': {'link': link({year_field: year}), 'title': str(year)},
+            'choices': [
+                {
+                    'link': link({year_field: year, month_field: month, day_field: period.day}),
+                    'title': capfirst(formats.date_format(period, 'MONTH_DAY_FORMAT')),
+                }
+                for period in periods(first, last, 'day')
+            ],
+        }
+    if year:
+        return {
+            'show': True,
+            'back': {'link': link({}), 'title': _('All dates')},
+            'choices': [
+                {
+                    'link': link({year_field: year, month_field: period.month}),
+                    'title': capfirst(formats.date_format(period, 'YEAR_MONTH_FORMAT')),
+                }
+                for period in periods(first, last, 'month')
+            ],
+        }
+    return {
+        'show': True,
+        'back': None,
+        'choices': [
+            {'link': link({year_field: str(period.year)}), 'title': str(period.year)}
+            for period in periods(first, last, 'year')
+        ],
+    }
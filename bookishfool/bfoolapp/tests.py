@@ -1,3 +1,1619 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, time as time_of_day, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from unittest.mock import ANY
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F, QuerySet
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .management.commands.benchmark_api import Scenarios, endpoints, scenario_name
+from .models import ArchivedBorrow, Author, Book, Borrow, Category, Hold, PenaltyEntry, UserProfile
+from . import metrics, renderers, search
+from .cache import cached_user_key, coalesced
+from .ingest import BookIngestion
+from .middleware import CompressionMiddleware
+from .pagination import EstimatedCountPaginator, KeysetPagination
+from .representations import (
+    BOOK_OUTPUT, author_rows, book_rows, borrow_rows, category_rows, hold_rows,
+    represent_authors, represent_books, represent_borrows, represent_categories, represent_holds,
+)
+from .serializers import AuthorSerializer, BookSerializer, BorrowSerializer, CategorySerializer, HoldSerializer
+from .services import archive_returned_borrows, expire_holds, hold_positions, place_hold
+
+
+class LibraryTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # The catalogue cache and the throttle buckets outlive each test's database rollback
+        cache.clear()
+        caches['throttle'].clear()
+
+
+def make_catalogue(count, authors_per_book=2):
+    category = Category.objects.create(name='Fiction')
+    authors = [Author.objects.create(name=f'Author {i}') for i in range(authors_per_book)]
+    books = []
+    for i in range(count):
+        book = Book.objects.create(
+            title=f'Book {i}', category=category, total_copies=5, available_copies=5
+        )
+        book.authors.set(authors)
+        books.append(book)
+    return books
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+
+def make_loan(user, book, due_date, return_date=None):
+    # Like borrowing through the API, keep the cached active-loan counter in step
+    if return_date is None:
+        UserProfile.objects.filter(user=user).update(active_borrow_count=F('active_borrow_count') + 1)
+    return Borrow.objects.create(user=user, book=book, due_date=due_date, return_date=return_date)
+
+
+class QueryCountTests(LibraryTestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_book_list_query_count_does_not_grow_with_rows(self):
+        make_catalogue(3)
+        small = self.count_queries(reverse('books') + '?page_size=100')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_catalogue(30)
+        large = self.count_queries(reverse('books') + '?page_size=100')
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 2)
+
+    def test_active_borrow_list_query_count_does_not_grow_with_rows(self):
+        user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.force_authenticate(user)
+        today = timezone.now().date()
+
+        books = make_catalogue(10)
+        Borrow.objects.create(user=user, book=books[0], due_date=today + timedelta(days=14))
+        small = self.count_queries(reverse('borrow-book'))
+        for book in books[1:]:
+            Borrow.objects.create(user=user, book=book, due_date=today + timedelta(days=14))
+        large = self.count_queries(reverse('borrow-book'))
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 2)
+
+
+class KeysetPaginationTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(25, authors_per_book=1)
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_walks_every_book_once_in_id_order(self):
+        ids = self.walk(reverse('books') + '?page_size=7')
+        self.assertEqual(ids, [book.id for book in self.books])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(KeysetPagination, 'max_page_size', 10):
+            response = self.client.get(reverse('books') + '?page_size=100000')
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertNotIn('count', response.data)
+
+    def test_deep_pages_use_keyset_not_offset(self):
+        first = self.client.get(reverse('books') + '?page_size=5')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(first.data['next'])
+        sql = ' '.join(q['sql'].upper() for q in ctx.captured_queries)
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_author_and_category_lists_are_paginated(self):
+        self.client.force_authenticate(self.admin)
+        for name in ('author-list-create', 'category-list-create'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('results', response.data)
+            self.assertIn('next', response.data)
+
+
+class BookAggregateTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(12, authors_per_book=1)
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_borrowing_counts_towards_popularity(self):
+        self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        self.client.post(reverse('bulk-borrow'), {'book_ids': [self.books[0].id, self.books[1].id]}, format='json')
+        counts = dict(Book.objects.filter(borrow_count__gt=0).values_list('pk', 'recent_borrow_count'))
+        self.assertEqual(counts, {self.books[0].id: 2, self.books[1].id: 1})
+
+    def test_rollup_drops_borrows_outside_the_window(self):
+        today = timezone.now().date()
+        old = make_loan(self.user, self.books[0], today, return_date=today)
+        make_loan(self.user, self.books[0], today, return_date=today)
+        Borrow.objects.filter(pk=old.pk).update(borrow_date=today - timedelta(days=45))
+        Book.objects.filter(pk=self.books[0].pk).update(borrow_count=2, recent_borrow_count=2)
+
+        out = io.StringIO()
+        call_command('rollup_book_stats', stdout=out)
+        self.assertIn('of 1 book(s)', out.getvalue())
+        book = Book.objects.get(pk=self.books[0].pk)
+        self.assertEqual((book.borrow_count, book.recent_borrow_count), (2, 1))
+
+    def test_popular_ordering_pages_through_ties(self):
+        counts = [3, 0, 5, 3, 0, 1, 3, 0, 0, 5, 2, 0]
+        for book, count in zip(self.books, counts):
+            Book.objects.filter(pk=book.pk).update(recent_borrow_count=count)
+        expected = [book.id for count, book in sorted(zip(counts, self.books), key=lambda p: (-p[0], -p[1].id))]
+        self.assertEqual(self.walk(reverse('books') + '?ordering=popular&page_size=2'), expected)
+
+        response = self.client.get(reverse('books') + '?ordering=title')
+        self.assertEqual(response.status_code, 400)
+
+    def test_available_filter(self):
+        Book.objects.filter(pk__in=[self.books[1].pk, self.books[4].pk]).update(available_copies=0)
+        ids = self.walk(reverse('books') + '?available=true&page_size=5')
+        self.assertEqual(ids, [book.id for book in self.books if book.id not in (self.books[1].id, self.books[4].id)])
+
+
+class BorrowReturnTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.force_authenticate(self.user)
+        self.books = make_catalogue(4, authors_per_book=1)
+
+    def borrow(self, book):
+        return self.client.post(reverse('borrow-book'), {'book_id': book.id})
+
+    def test_borrow_decrements_inventory(self):
+        response = self.borrow(self.books[0])
+        self.assertEqual(response.status_code, 201)
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].available_copies, 4)
+
+    def test_borrow_limit(self):
+        for book in self.books[:3]:
+            self.assertEqual(self.borrow(book).status_code, 201)
+        response = self.borrow(self.books[3])
+        self.assertEqual(response.status_code, 400)
+        self.books[3].refresh_from_db()
+        self.assertEqual(self.books[3].available_copies, 5)
+
+    def test_no_copies_left(self):
+        Book.objects.filter(pk=self.books[0].pk).update(available_copies=0)
+        self.assertEqual(self.borrow(self.books[0]).status_code, 400)
+        self.assertFalse(Borrow.objects.exists())
+
+    def test_late_return_adds_penalty_once(self):
+        self.borrow(self.books[0])
+        borrow = Borrow.objects.get()
+        Borrow.objects.filter(pk=borrow.pk).update(due_date=timezone.now().date() - timedelta(days=4))
+
+        response = self.client.post(reverse('return-book'), {'borrow_id': borrow.id})
+        self.assertEqual(response.status_code, 200)
+        again = self.client.post(reverse('return-book'), {'borrow_id': borrow.id})
+        self.assertEqual(again.status_code, 400)
+
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.penalty_point, 4)
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].available_copies, 5)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=60_000)  # lock waits are expected here
+class ConcurrentBorrowTests(TransactionTestCase):
+    borrowers = 100
+    copies = 10
+
+    def test_parallel_borrowers_never_oversell(self):
+        from .services import InventoryError, borrow_book
+
+        book = make_catalogue(1, authors_per_book=1)[0]
+        Book.objects.filter(pk=book.pk).update(total_copies=self.copies, available_copies=self.copies)
+        users = [User.objects.create_user(username=f'user{i}') for i in range(self.borrowers)]
+        barrier = threading.Barrier(self.borrowers)
+        outcomes = []
+        errors = []
+
+        def worker(user):
+            barrier.wait()
+            try:
+                borrow_book(user, book)
+                outcomes.append('ok')
+            except InventoryError:
+                outcomes.append('sold out')
+            except Exception as e:  # e.g. "database is locked": the writers must queue, not fail
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(outcomes), self.borrowers)
+        self.assertEqual(outcomes.count('ok'), self.copies)
+        self.assertEqual(Borrow.objects.filter(book=book).count(), self.copies)
+        self.assertEqual(book.available_copies, 0)
+
+
+class BulkBorrowReturnTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='kiosk', password='pass12345')
+        self.client.force_authenticate(self.user)
+        self.books = make_catalogue(5, authors_per_book=1)
+
+    def test_bulk_borrow_reports_each_item(self):
+        Book.objects.filter(pk=self.books[1].pk).update(available_copies=0)
+        ids = [self.books[0].id, self.books[1].id, 999999, self.books[2].id, self.books[3].id, self.books[4].id]
+        response = self.client.post(reverse('bulk-borrow'), {'book_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+
+        self.assertIn('borrow_id', results[0])
+        self.assertEqual(results[1]['error'], 'No available copies to borrow.')
+        self.assertEqual(results[2]['error'], 'Book not found.')
+        self.assertIn('borrow_id', results[3])
+        self.assertIn('borrow_id', results[4])
+        self.assertIn('up to 3', results[5]['error'])
+        self.assertEqual(Borrow.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).available_copies, 4)
+        self.assertEqual(Book.objects.get(pk=self.books[4].pk).available_copies, 5)
+
+    def test_bulk_borrow_runs_constant_queries(self):
+        url = reverse('bulk-borrow')
+        with CaptureQueriesContext(connection) as one:
+            self.client.post(url, {'book_ids': [self.books[0].id]}, format='json')
+        Borrow.objects.all().delete()
+        with CaptureQueriesContext(connection) as three:
+            self.client.post(url, {'book_ids': [b.id for b in self.books[1:4]]}, format='json')
+        self.assertEqual(len(one.captured_queries), len(three.captured_queries))
+
+    def test_bulk_borrow_rechecks_what_it_read(self):
+        url = reverse('bulk-borrow')
+        ids = [self.books[0].id, self.books[1].id]
+        real_in_bulk = QuerySet.in_bulk
+
+        def then(change):
+            def in_bulk(queryset, *args, **kwargs):
+                rows = real_in_bulk(queryset, *args, **kwargs)
+                change()  # as a concurrent request would, between the read and the writes (rolled back with them)
+                return rows
+            return in_bulk
+
+        with mock.patch.object(QuerySet, 'in_bulk', then(lambda: Book.objects.filter(pk=ids[1]).update(available_copies=0))):
+            response = self.client.post(url, {'book_ids': ids}, format='json')
+        self.assertEqual((response.status_code, response.data['error']), (400, 'No available copies to borrow.'))
+        with mock.patch.object(QuerySet, 'in_bulk', then(lambda: UserProfile.objects.update(active_borrow_count=2))):
+            response = self.client.post(url, {'book_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('up to 3', response.data['error'])
+
+        self.assertFalse(Borrow.objects.exists())
+        self.assertEqual(Book.objects.get(pk=ids[0]).available_copies, 5)
+        self.assertEqual(UserProfile.objects.get(user=self.user).active_borrow_count, 0)
+
+    def test_bulk_return_aggregates_penalties(self):
+        today = timezone.now().date()
+        borrows = [
+            make_loan(self.user, book, today - timedelta(days=days))
+            for book, days in zip(self.books, (2, 3, -1))
+        ]
+        Book.objects.update(available_copies=4)
+        ids = [b.id for b in borrows] + [borrows[0].id]
+        response = self.client.post(reverse('bulk-return'), {'borrow_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+
+        self.assertEqual([r.get('penalty_points') for r in results[:3]], [2, 3, 0])
+        self.assertEqual(results[3]['error'], 'Book already returned.')
+        self.user.userprofile.refresh_from_db()
+        self.assertEqual(self.user.userprofile.penalty_point, 5)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).available_copies, 5)
+        self.assertFalse(Borrow.objects.filter(user=self.user).active().exists())
+
+    def test_bulk_requires_a_list(self):
+        response = self.client.post(reverse('bulk-borrow'), {'book_ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogueCacheTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(3, authors_per_book=1)
+        self.url = reverse('books')
+
+    def test_repeat_reads_skip_the_database(self):
+        first = self.client.get(self.url, {'category': self.books[0].category_id})
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {'category': self.books[0].category_id})
+        self.assertEqual(first.data, second.data)
+
+    def test_different_filters_are_cached_separately(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {'author': 999999})
+        self.assertEqual(response.data['results'], [])
+
+    def test_catalogue_edits_invalidate(self):
+        self.client.get(self.url)
+        self.books[0].title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['title'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(name='New author')
+            self.books[1].authors.add(Author.objects.get(name='New author'))
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results'][1]['authors']), 2)
+
+    def test_invalidates_only_once_the_change_commits(self):
+        self.client.get(self.url)
+        self.books[0].title = 'Renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.books[0].save()
+            response = self.client.get(self.url)
+        self.assertNotEqual(response.data['results'][0]['title'], 'Renamed')
+        self.assertEqual(len(callbacks), 1)
+
+    def test_borrowing_invalidates_available_copies(self):
+        user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.get(self.url)
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['available_copies'], 4)
+
+    def test_etag_revalidation(self):
+        first = self.client.get(self.url)
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+
+class RepresentationParityTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(6, authors_per_book=3)
+        Author.objects.filter(name='Author 1').update(bio='Line one\nLine "two"')
+        lonely = Book.objects.create(
+            title='No authors', description='ünïcode', category=Category.objects.create(name='Misc'),
+            total_copies=1, available_copies=0,
+        )
+        self.books.append(lonely)
+        self.user = User.objects.create_user(username='reader', email='r@example.com', password='pass12345')
+        today = timezone.now().date()
+        Borrow.objects.create(user=self.user, book=self.books[0], due_date=today)
+        Borrow.objects.create(user=self.user, book=lonely, due_date=today, return_date=today)
+
+    def assertSameJSON(self, fast, serializer_data):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(serializer_data))
+
+    def test_books(self):
+        queryset = Book.objects.with_details().order_by('id')
+        self.assertSameJSON(
+            represent_books(book_rows(queryset)), BookSerializer(queryset, many=True).data
+        )
+
+    def test_authors_and_categories(self):
+        self.assertSameJSON(
+            represent_authors(author_rows()), AuthorSerializer(Author.objects.all(), many=True).data
+        )
+        self.assertSameJSON(
+            represent_categories(category_rows()), CategorySerializer(Category.objects.all(), many=True).data
+        )
+
+    def test_borrows(self):
+        queryset = Borrow.objects.with_details().order_by('id')
+        self.assertSameJSON(
+            represent_borrows(borrow_rows(queryset)), BorrowSerializer(queryset, many=True).data
+        )
+
+    def test_holds(self):
+        place_hold(self.user, self.books[-1])
+        place_hold(User.objects.create(username='other'), self.books[-1])
+        Hold.objects.filter(user=self.user).update(ready_at=timezone.now(), status=Hold.READY)
+        queryset = Hold.objects.order_by('id')
+        positions = hold_positions(queryset.values_list('pk', flat=True))
+        self.assertSameJSON(
+            represent_holds(hold_rows(queryset), positions),
+            HoldSerializer(queryset, many=True, context={'positions': positions}).data,
+        )
+
+
+class BulkIngestTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        self.client.force_authenticate(self.admin)
+        self.category = Category.objects.create(name='Fiction')
+        self.authors = [Author.objects.create(name=f'Author {i}', external_id=f'a{i}') for i in range(3)]
+
+    def ingest(self, name, items):
+        with self.assertLogs('bfoolapp.views', 'INFO'):
+            response = self.client.post(reverse(name), {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def book(self, key, **fields):
+        return {
+            'external_id': key, 'title': f'Book {key}', 'total_copies': 2, 'available_copies': 2,
+            'category_id': self.category.id, 'author_ids': [self.authors[0].id], **fields,
+        }
+
+    def test_creates_books_with_authors_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            self.ingest('books-bulk', [self.book(f'b{i}') for i in range(3)])
+        with CaptureQueriesContext(connection) as large:
+            data = self.ingest('books-bulk', [self.book(f'c{i}', author_ids=[a.id for a in self.authors]) for i in range(60)])
+        self.assertEqual(len(large), len(small))
+        self.assertEqual((data['created'], data['updated'], data['failed']), (60, 0, 0))
+        self.assertEqual(Book.authors.through.objects.count(), 3 + 180)
+        book = Book.objects.get(external_id='c7')
+        self.assertEqual(data['results'][7], {'id': book.id, 'external_id': 'c7', 'created': True})
+        self.assertEqual(search.search_books('c7', limit=5), [book.id])
+
+    def test_upserts_on_external_id_and_reports_bad_rows(self):
+        self.ingest('books-bulk', [self.book('b1'), self.book('b2')])
+        before = Book.objects.get(external_id='b1').updated_at
+        data = self.ingest('books-bulk', [
+            {'external_id': 'b1', 'title': 'Renamed', 'author_ids': [self.authors[1].id, self.authors[2].id]},
+            self.book('b3', category_id=999),
+            {'external_id': 'b4', 'title': 'Incomplete'},
+            self.book('b5', total_copies=-1),
+            self.book('b6'),
+            self.book('b6'),
+        ])
+        self.assertEqual((data['created'], data['updated'], data['failed']), (1, 1, 4))
+        results = data['results']
+        self.assertFalse(results[0]['created'])
+        self.assertEqual(results[1]['error'], {'category_id': ['Invalid pk "999" - object does not exist.']})
+        self.assertIn('total_copies', results[2]['error'])
+        self.assertIn('total_copies', results[3]['error'])
+        self.assertTrue(results[4]['created'])
+        self.assertIn('non_field_errors', results[5]['error'])
+
+        book = Book.objects.get(external_id='b1')
+        self.assertEqual((book.title, book.total_copies), ('Renamed', 2))
+        self.assertGreater(book.updated_at, before)
+        self.assertEqual(sorted(book.authors.values_list('pk', flat=True)), [self.authors[1].id, self.authors[2].id])
+        self.assertEqual(Book.objects.count(), 3)
+
+    def test_updates_write_only_the_fields_each_item_sent(self):
+        self.ingest('books-bulk', [self.book('b1'), self.book('b2')])
+        resolve = BookIngestion.resolve
+
+        def resolve_then_lend(ingestion, valid, results):
+            targets = resolve(ingestion, valid, results)
+            # A loan of b2 after its row was loaded
+            Book.objects.filter(external_id='b2').update(available_copies=1)
+            return targets
+
+        with mock.patch.object(BookIngestion, 'resolve', resolve_then_lend):
+            self.ingest('books-bulk', [
+                {'external_id': 'b1', 'total_copies': 5, 'available_copies': 5},
+                {'external_id': 'b2', 'title': 'Renamed'},
+            ])
+        b1, b2 = Book.objects.order_by('external_id')
+        self.assertEqual((b1.total_copies, b1.available_copies), (5, 5))
+        self.assertEqual((b2.title, b2.total_copies, b2.available_copies), ('Renamed', 2, 1))
+
+    def test_author_and_category_updates_touch_their_books(self):
+        self.ingest('books-bulk', [self.book('b1')])
+        data = self.ingest('author-bulk', [
+            {'external_id': 'a0', 'name': 'Zebediah'}, {'id': self.authors[1].id, 'external_id': 'a2'}, {'name': 'New'},
+        ])
+        self.assertEqual(data['results'][1]['error'], {'external_id': [f'Already used by id {self.authors[2].id}.']})
+        self.assertTrue(data['results'][2]['created'])
+        self.assertEqual(search.search_books('zebediah', limit=5), [Book.objects.get().id])
+
+        before = Book.objects.get().updated_at
+        data = self.ingest('category-bulk', [{'id': self.category.id, 'name': 'Classics'}, {'id': 999, 'name': 'x'}])
+        self.assertEqual((data['updated'], data['failed']), (1, 1))
+        self.assertGreater(Book.objects.get().updated_at, before)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='reader', password='pass12345'))
+        response = self.client.post(reverse('category-bulk'), {'items': [{'name': 'x'}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class SparseFieldsetTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(3, authors_per_book=2)
+        Author.objects.update(bio='A long biography')
+        self.user = User.objects.create_user(username='reader', email='r@example.com', password='pass12345')
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        make_loan(self.user, self.books[1], timezone.now().date() + timedelta(days=14))
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, ' '.join(query['sql'] for query in queries)
+
+    def test_books_select_only_the_requested_columns(self):
+        data, sql = self.get(reverse('books'), fields='title,authors')
+        author = {'id': self.books[0].authors.first().id, 'name': 'Author 0'}
+        self.assertEqual(data['results'][0], {'id': self.books[0].id, 'title': 'Book 0', 'authors': [author, ANY]})
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"bio"', sql)
+
+        data, sql = self.get(reverse('books'), fields='title,authors', expand='authors')
+        self.assertEqual(data['results'][0]['authors'][0]['bio'], 'A long biography')
+
+        data, sql = self.get(reverse('books'), fields='title', ordering='popular')
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+        self.assertNotIn('bfoolapp_book_authors', sql)
+
+        response = self.client.get(reverse('books'), {'fields': 'title,isbn'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('isbn', str(response.data['fields']))
+
+    def test_full_representation_by_default(self):
+        data, _ = self.get(reverse('books'))
+        self.assertEqual(list(data['results'][0]), list(BOOK_OUTPUT))
+        self.assertIn('bio', data['results'][0]['authors'][0])
+
+    def test_compact_loans(self):
+        self.client.force_authenticate(self.user)
+        data, sql = self.get(reverse('borrow-book'), fields='book,due_date')
+        self.assertEqual(data, [{'id': ANY, 'book': {'id': self.books[1].id, 'title': 'Book 1'}, 'due_date': ANY}])
+        self.assertNotIn('bfoolapp_book_authors', sql)
+
+        data, _ = self.get(reverse('borrow-book'), expand='user')
+        self.assertEqual(data[0]['user'], {'id': self.user.id, 'username': 'reader', 'email': 'r@example.com'})
+        self.assertEqual(data[0]['book'], {'id': self.books[1].id, 'title': 'Book 1'})
+
+    def test_authors(self):
+        self.client.force_authenticate(self.admin)
+        data, sql = self.get(reverse('author-list-create'), fields='name')
+        self.assertEqual(data['results'][0], {'id': ANY, 'name': 'Author 0'})
+        self.assertNotIn('"bio"', sql)
+
+    async def test_async_endpoints(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        client = AsyncClient()
+        response = await client.get(reverse('async-borrow'), {'fields': 'book'}, headers=headers)
+        self.assertEqual(response.json(), [{'id': ANY, 'book': {'id': self.books[1].id, 'title': 'Book 1'}}])
+        response = await client.get(reverse('async-books'), {'fields': 'authors', 'page_size': 1})
+        self.assertEqual(response.json()['results'][0]['authors'][0], {'id': ANY, 'name': 'Author 0'})
+        response = await client.get(reverse('async-books'), {'expand': 'category'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LoanArchiveTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(2, authors_per_book=1)
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.today = timezone.now().date()
+        # Returned 200, 150, 100 and 10 days ago, then one still out
+        self.loans = [
+            make_loan(self.user, self.books[i % 2], self.today, return_date=self.today - timedelta(days=days))
+            for i, days in enumerate((200, 150, 100, 10))
+        ] + [make_loan(self.user, self.books[0], self.today + timedelta(days=14))]
+        PenaltyEntry.objects.create(user=self.user, borrow=self.loans[0], points=2, reason=PenaltyEntry.LATE_RETURN)
+
+    def test_archives_old_returned_loans_in_batches(self):
+        self.assertEqual(archive_returned_borrows(batch_size=2), 3)
+        self.assertEqual(sorted(Borrow.objects.values_list('pk', flat=True)), [self.loans[3].pk, self.loans[4].pk])
+        archived = ArchivedBorrow.objects.get(pk=self.loans[0].pk)
+        self.assertEqual((archived.user_id, archived.book_id, archived.return_date), (
+            self.user.pk, self.books[0].pk, self.today - timedelta(days=200),
+        ))
+        self.assertIsNone(PenaltyEntry.objects.get().borrow_id)
+        self.assertEqual(archive_returned_borrows(), 0)
+
+    def test_command_keeps_the_popularity_window(self):
+        out = io.StringIO()
+        call_command('archive_loans', days=120, stdout=out)
+        self.assertIn('Archived 2 returned loan(s)', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('archive_loans', days=7, stdout=io.StringIO())
+
+    def test_history_reads_both_tables_newest_first(self):
+        archive_returned_borrows()
+        self.client.force_authenticate(self.user)
+        url = reverse('user-loans', args=[self.user.id]) + '?page_size=2'
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).data
+            self.assertEqual(len(queries), 2)
+            seen += [(loan['id'], loan['archived']) for loan in data['results']]
+            url = data['next']
+        self.assertEqual(seen, [(loan.pk, i < 3) for i, loan in reversed(list(enumerate(self.loans)))])
+
+        other = User.objects.create_user(username='other', password='pass12345')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse('user-loans', args=[self.user.id])).status_code, 403)
+
+
+class ResponseEncodingTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(30, authors_per_book=2)
+
+    def test_backends_render_like_drf(self):
+        data = {
+            'when': datetime(2024, 5, 1, 12, 30, 15, 120, tzinfo=timezone.get_fixed_timezone(0)),
+            'day': date(2024, 5, 1), 'price': Decimal('1.50'), 1: 'int key',
+            'text': 'ünïcode \u2028 "quoted"', 'nested': [None, True, 1.5],
+        }
+        expected = JSONRenderer().render(data)
+        for backend in ('stdlib', 'orjson'):
+            with self.subTest(backend=backend), self.settings(JSON_BACKEND=backend):
+                self.assertEqual(renderers.dumps(data), expected)
+
+    def test_large_responses_are_gzipped(self):
+        url = reverse('books') + '?page_size=30'
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        small = self.client.get(reverse('books') + '?page_size=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_conditional_get_on_any_endpoint(self):
+        user = User.objects.create_user(username='reader', password='pass12345')
+        make_loan(user, self.books[0], timezone.now().date())
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('borrow-book'))
+        again = self.client.get(reverse('borrow-book'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+
+class BookExportTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(5, authors_per_book=2)
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('books-export')
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export_streams_in_chunks(self):
+        with mock.patch('bfoolapp.views.BookExportAPIView.chunk_size', 2):
+            response = self.client.get(self.url)
+            with CaptureQueriesContext(connection) as ctx:
+                body = self.read(response)
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([book['id'] for book in lines], [book.id for book in self.books])
+        self.assertEqual(len(lines[0]['authors']), 2)
+        self.assertEqual(lines[0]['category']['name'], 'Fiction')
+        # one book query plus one author query per chunk of two
+        self.assertEqual(len(ctx.captured_queries), 1 + 3)
+
+    def test_csv_export(self):
+        body = self.read(self.client.get(self.url, {'type': 'csv'}))
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][8], 'Author 0|Author 1')
+
+    def test_since_only_returns_changed_books(self):
+        cutoff = timezone.now() + timedelta(seconds=1)
+        Book.objects.update(updated_at=cutoff - timedelta(days=1))
+        with mock.patch('django.utils.timezone.now', return_value=cutoff + timedelta(minutes=1)):
+            self.books[2].save()
+            Author.objects.get(name='Author 1').books_has_authors.remove(self.books[4])
+        body = self.read(self.client.get(self.url, {'since': cutoff.isoformat()}))
+        ids = [json.loads(line)['id'] for line in body.splitlines()]
+        self.assertEqual(ids, [self.books[2].id, self.books[4].id])
+
+    def test_export_is_admin_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='reader'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'type': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+
+
+class OverdueScanTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(3, authors_per_book=1)
+        self.alice = User.objects.create_user(username='alice', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', password='pass12345')
+        self.start = date(2026, 1, 1)
+        due = self.start + timedelta(days=14)
+        self.alice_loan = make_loan(self.alice, self.books[0], due)
+        make_loan(self.alice, self.books[1], due + timedelta(days=2))
+        make_loan(self.bob, self.books[2], due)
+        make_loan(self.bob, self.books[0], due - timedelta(days=30), return_date=due - timedelta(days=20))
+
+    def frozen(self, day):
+        return mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime.combine(day, time_of_day())))
+
+    def penalty(self, user):
+        return UserProfile.objects.get(user=user).penalty_point
+
+    def scan(self, day):
+        with self.frozen(day):
+            call_command('scan_overdue', stdout=io.StringIO())
+
+    def test_accrues_incrementally_and_idempotently(self):
+        due = self.start + timedelta(days=14)
+        self.scan(due + timedelta(days=3))
+        self.assertEqual(self.penalty(self.alice), 3 + 1)
+        self.assertEqual(self.penalty(self.bob), 3)
+
+        self.scan(due + timedelta(days=3))
+        self.assertEqual(self.penalty(self.alice), 4)
+
+        self.scan(due + timedelta(days=5))
+        self.assertEqual(self.penalty(self.alice), 5 + 3)
+        self.assertEqual(self.penalty(self.bob), 5)
+
+    def test_return_charges_only_unaccrued_days(self):
+        due = self.start + timedelta(days=14)
+        self.scan(due + timedelta(days=3))
+        self.client.force_authenticate(self.alice)
+        with self.frozen(due + timedelta(days=4)):
+            response = self.client.post(reverse('return-book'), {'borrow_id': self.alice_loan.id})
+        self.assertIn('1 penalty point', response.data['message'])
+        self.assertEqual(self.penalty(self.alice), 4 + 1)
+
+        self.scan(due + timedelta(days=10))
+        # Only the still-open loan keeps accruing: 10 - 2 = 8 days in total for it
+        self.assertEqual(self.penalty(self.alice), 3 + 1 + 8)
+
+    def test_batch_size_does_not_change_totals(self):
+        due = self.start + timedelta(days=14)
+        with self.frozen(due + timedelta(days=6)):
+            call_command('scan_overdue', '--user-batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.penalty(self.alice), 6 + 4)
+        self.assertEqual(self.penalty(self.bob), 6)
+
+
+class LoanCounterTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.force_authenticate(self.user)
+        self.books = make_catalogue(4, authors_per_book=1)
+
+    def profile(self):
+        return UserProfile.objects.get(user=self.user)
+
+    def test_counter_follows_borrow_and_return(self):
+        self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        self.client.post(reverse('bulk-borrow'), {'book_ids': [self.books[1].id, self.books[2].id]}, format='json')
+        self.assertEqual(self.profile().active_borrow_count, 3)
+
+        borrow = Borrow.objects.filter(user=self.user).first()
+        self.client.post(reverse('return-book'), {'borrow_id': borrow.id})
+        self.assertEqual(self.profile().active_borrow_count, 2)
+
+    def test_limit_is_checked_against_the_counter(self):
+        UserProfile.objects.filter(user=self.user).update(active_borrow_count=3)
+        response = self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).available_copies, 5)
+
+    def test_loans_return_even_when_the_counter_has_drifted(self):
+        # Created outside services.py (e.g. the admin add form): the counter stays at 0
+        today = timezone.now().date()
+        loans = [Borrow.objects.create(user=self.user, book=book, due_date=today) for book in self.books[:3]]
+        response = self.client.post(reverse('return-book'), {'borrow_id': loans[0].id})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('bulk-return'), {'borrow_ids': [loans[1].id, loans[2].id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Borrow.objects.filter(user=self.user).active().exists())
+        self.assertEqual(self.profile().active_borrow_count, 0)
+
+    def test_late_return_is_recorded_in_the_ledger(self):
+        loan = make_loan(self.user, self.books[0], timezone.now().date() - timedelta(days=2))
+        self.client.post(reverse('return-book'), {'borrow_id': loan.id})
+        entry = PenaltyEntry.objects.get(user=self.user)
+        self.assertEqual((entry.points, entry.reason, entry.borrow_id), (2, PenaltyEntry.LATE_RETURN, loan.id))
+        self.assertEqual(self.profile().penalty_point, 2)
+
+    def test_penalty_view_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-penalties', args=[self.user.id]))
+        self.assertEqual(response.data, {'username': 'reader', 'penalty_points': 0})
+
+    def test_reconcile_reports_and_repairs_drift(self):
+        make_loan(self.user, self.books[0], timezone.now().date())
+        PenaltyEntry.objects.create(user=self.user, points=4, reason=PenaltyEntry.OVERDUE)
+        UserProfile.objects.filter(user=self.user).update(active_borrow_count=0, penalty_point=1)
+
+        out = io.StringIO()
+        call_command('reconcile_loans', stdout=out)
+        self.assertIn('reader', out.getvalue())
+        self.assertEqual(self.profile().active_borrow_count, 0)
+
+        call_command('reconcile_loans', '--fix', stdout=io.StringIO())
+        profile = self.profile()
+        self.assertEqual((profile.active_borrow_count, profile.penalty_point), (1, 4))
+
+        out = io.StringIO()
+        call_command('reconcile_loans', stdout=out)
+        self.assertIn('No drift found.', out.getvalue())
+
+
+class BookSearchTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        fiction = Category.objects.create(name='Fiction')
+        self.tolkien = Author.objects.create(name='J. R. R. Tolkien')
+        self.herbert = Author.objects.create(name='Frank Herbert')
+        self.hobbit = Book.objects.create(
+            title='The Hobbit', description='A dragon and some dwarves.',
+            category=fiction, total_copies=2, available_copies=2,
+        )
+        self.hobbit.authors.set([self.tolkien])
+        self.dune = Book.objects.create(
+            title='Dune', description='Spice, sand and a hobbit-free desert planet.',
+            category=fiction, total_copies=2, available_copies=2,
+        )
+        self.dune.authors.set([self.herbert])
+        self.url = reverse('books-search')
+
+    def ids(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [book['id'] for book in response.data['results']]
+
+    def check_search(self):
+        self.assertEqual(self.ids('tolkien'), [self.hobbit.id])
+        self.assertEqual(self.ids('hobbit'), [self.hobbit.id, self.dune.id])  # title beats description
+        self.assertEqual(self.ids('frank dun'), [self.dune.id])  # last word is a prefix
+        self.assertEqual(self.ids('dragon sand'), [])  # every word must match
+        self.assertEqual(self.ids('hobbit hobbit'), [self.hobbit.id, self.dune.id])  # repeated words
+        self.assertEqual(self.ids('spice sand spice'), [self.dune.id])
+        self.assertEqual(self.ids('dwarf dwarf'), [])  # the repeat is still a whole word, not 'dwarves'
+
+        self.tolkien.name = 'John Ronald Reuel Tolkien'
+        self.tolkien.save()
+        self.assertEqual(self.ids('reuel'), [self.hobbit.id])
+
+        self.dune.authors.add(self.tolkien)
+        self.assertEqual(self.ids('reuel'), [self.hobbit.id, self.dune.id])
+
+        self.herbert.delete()
+        self.assertEqual(self.ids('herbert'), [])
+
+        self.hobbit.delete()
+        self.assertEqual(self.ids('dragon'), [])
+
+    def test_fts5_backend(self):
+        self.assertEqual(search.backend(), 'fts5')
+        self.check_search()
+
+    def test_python_backend(self):
+        with self.settings(SEARCH_BACKEND='python'):
+            search.rebuild_index()
+            self.check_search()
+
+    def test_paginates_without_count(self):
+        for i in range(5):
+            Book.objects.create(title=f'Hobbit sequel {i}', category=self.hobbit.category,
+                                total_copies=1, available_copies=1)
+        first = self.client.get(self.url, {'q': 'hobbit', 'page_size': 4})
+        self.assertEqual(len(first.data['results']), 4)
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 3)
+        self.assertIsNone(second.data['next'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        self.assertEqual(self.ids('dune'), [])
+        call_command('rebuild_search_index', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.ids('dune'), [self.dune.id])
+
+    def test_requires_a_query(self):
+        self.assertEqual(self.client.get(self.url, {'q': '  '}).status_code, 400)
+
+    def test_remove_books_chunks_its_in_list(self):
+        with CaptureQueriesContext(connection) as ctx:
+            search.remove_books([self.hobbit.id, self.dune.id, 999999], chunk_size=2)
+        self.assertEqual(len([query for query in ctx.captured_queries if query['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(self.ids('dune'), [])
+        self.assertEqual(self.ids('hobbit'), [])
+
+    @override_settings(SEARCH_BACKEND='auto')
+    def test_rebuild_rechecks_the_backend(self):
+        has_fts = search.FTS_TABLE in connection.introspection.table_names()
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            search.forget_backend()
+            self.assertEqual(search.backend(), 'python')  # now cached, as if the table were created later
+        search.rebuild_index()
+        self.assertEqual(search.backend(), 'fts5' if has_fts else 'python')
+        self.assertEqual(self.ids('dune'), [self.dune.id])
+
+
+class AsyncReadViewTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(12, authors_per_book=2)
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        make_loan(self.user, self.books[0], timezone.now().date() + timedelta(days=14))
+
+    def bearer(self, user):
+        return {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    async def test_books_match_the_sync_representation(self):
+        client = AsyncClient()
+        response = await client.get(reverse('async-books'), {'page_size': 5})
+        data = response.json()
+        self.assertEqual(len(data['results']), 5)
+        page = await sync_to_async(lambda: represent_books(book_rows(Book.objects.order_by('id')[:5])))()
+        self.assertEqual(data['results'], page)
+
+        ids = [book['id'] for book in data['results']]
+        while data['next']:
+            data = (await client.get(data['next'])).json()
+            ids.extend(book['id'] for book in data['results'])
+        self.assertEqual(ids, [book.id for book in self.books])
+
+    @throttle_rates()  # pages through both views from one address
+    async def test_books_filter_and_order_like_the_sync_view(self):
+        await Book.objects.filter(pk=self.books[3].pk).aupdate(available_copies=0)
+        for pk, count in ((self.books[5].pk, 4), (self.books[2].pk, 4), (self.books[7].pk, 9)):
+            await Book.objects.filter(pk=pk).aupdate(recent_borrow_count=count)
+        client = AsyncClient()
+        for query in ({'available': 'true'}, {'ordering': 'popular'}, {'ordering': 'popular', 'available': 'true'}):
+            params = {**query, 'page_size': 2}
+            sync_ids, async_ids = [], []
+            sync_page = await sync_to_async(self.client.get)(reverse('books'), params)
+            async_page = (await client.get(reverse('async-books'), params)).json()
+            sync_ids += [book['id'] for book in sync_page.data['results']]
+            async_ids += [book['id'] for book in async_page['results']]
+            while async_page['next']:
+                async_page = (await client.get(async_page['next'])).json()
+                async_ids += [book['id'] for book in async_page['results']]
+            while sync_page.data['next']:
+                sync_page = await sync_to_async(self.client.get)(sync_page.data['next'])
+                sync_ids += [book['id'] for book in sync_page.data['results']]
+            self.assertEqual(async_ids, sync_ids, query)
+        self.assertEqual(async_ids[:3], [self.books[7].pk, self.books[5].pk, self.books[2].pk])
+        self.assertNotIn(self.books[3].pk, async_ids)
+
+        response = await client.get(reverse('async-books'), {'ordering': 'title'})
+        self.assertEqual((response.status_code, response.json()), (400, {'ordering': 'Only "popular" is supported.'}))
+
+    async def test_authors_and_categories_are_admin_only(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get(reverse('async-authors'))).status_code, 401)
+        response = await client.get(reverse('async-authors'), headers=self.bearer(self.user))
+        self.assertEqual(response.status_code, 403)
+        response = await client.get(reverse('async-categories'), headers=self.bearer(self.admin))
+        self.assertEqual(response.json()['results'], [{'id': self.books[0].category_id, 'name': 'Fiction'}])
+
+    async def test_active_borrows_and_penalties(self):
+        client = AsyncClient()
+        response = await client.get(reverse('async-borrow'), headers=self.bearer(self.user))
+        self.assertEqual([loan['book']['id'] for loan in response.json()], [self.books[0].id])
+
+        url = reverse('async-user-penalties', args=[self.user.id])
+        response = await client.get(url, headers=self.bearer(self.user))
+        self.assertEqual(response.json(), {'username': 'reader', 'penalty_points': 0})
+        response = await client.get(reverse('async-user-penalties', args=[self.admin.id]), headers=self.bearer(self.user))
+        self.assertEqual(response.status_code, 403)
+
+    async def test_rejects_bad_tokens(self):
+        response = await AsyncClient().get(reverse('async-borrow'), headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True)  # simplejwt rebinds, not updates, on override_settings
+    async def test_password_change_revokes_tokens(self):
+        headers = self.bearer(self.user)
+        client = AsyncClient()
+        self.assertEqual((await client.get(reverse('async-borrow'), headers=headers)).status_code, 200)
+        self.user.set_password('changed123')
+        await self.user.asave()
+        await cache.adelete(cached_user_key(self.user.pk))  # what saving does on commit
+        response = await client.get(reverse('async-borrow'), headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': "The user's password has been changed."})
+
+
+class CachedAuthenticationTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.books = make_catalogue(3, authors_per_book=1)
+        self.user = User.objects.create_user(username='reader', password='pass12345')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def user_queries(self, captured):
+        return [query['sql'] for query in captured if 'FROM "auth_user"' in query['sql']]
+
+    def test_user_is_looked_up_once_per_ttl(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.post(reverse('borrow-book'), {'book_id': self.books[1].id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.user_queries(first)), 1)
+        self.assertEqual(self.user_queries(second), [])
+        self.assertEqual(len(second), len(first) - 1)
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        self.client.post(reverse('borrow-book'), {'book_id': self.books[0].id})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.post(reverse('borrow-book'), {'book_id': self.books[1].id})
+        self.assertEqual(response.status_code, 401)
+
+    def test_read_only_endpoints_use_token_claims(self):
+        make_loan(self.user, self.books[0], timezone.now().date() + timedelta(days=14))
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('borrow-book'))
+        self.assertEqual([loan['book']['id'] for loan in response.data], [self.books[0].id])
+        self.assertEqual(self.user_queries(captured), [])
+
+    def test_login_token_carries_staff_claim(self):
+        User.objects.create_superuser(username='admin', password='pass12345')
+        response = self.client.post(reverse('login'), {'username': 'admin', 'password': 'pass12345'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get(reverse('user-penalties', args=[self.user.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_checks_do_not_trust_the_token_claim(self):
+        admin = User.objects.create_superuser(username='admin', password='pass12345')
+        response = self.client.post(reverse('login'), {'username': 'admin', 'password': 'pass12345'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.is_staff = False
+            admin.save()
+        for name in ('user-penalties', 'user-loans'):
+            response = self.client.get(reverse(name, args=[self.user.id]))
+            self.assertEqual(response.status_code, 403)
+
+
+class UserProfileCreationTests(LibraryTestCase):
+    def test_saving_a_user_does_not_touch_the_profile(self):
+        user = User.objects.create_user(username='reader', password='pass12345')
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        user.first_name = 'Ann'
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_users_without_a_profile_get_one_on_first_use(self):
+        user = User.objects.bulk_create([User(username='imported')])[0]
+        book = make_catalogue(1, authors_per_book=1)[0]
+        self.client.force_authenticate(user)
+
+        response = self.client.get(reverse('user-penalties', args=[user.id]))
+        self.assertEqual(response.data, {'username': 'imported', 'penalty_points': 0})
+        UserProfile.objects.filter(user=user).delete()
+        response = self.client.post(reverse('borrow-book'), {'book_id': book.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UserProfile.objects.get(user=user).active_borrow_count, 1)
+
+    def test_import_users_creates_profiles_in_bulk(self):
+        User.objects.create_user(username='existing')
+        hashed = make_password('secret123')
+        path = self.write_csv([
+            ['username', 'email', 'password'],
+            ['existing', '', ''],
+            ['ann', 'ann@example.com', hashed],
+            ['bob', '', ''],
+        ])
+        with CaptureQueriesContext(connection) as captured:
+            call_command('import_users', path, stdout=io.StringIO())
+        self.assertLessEqual(len(captured), 6)
+        self.assertTrue(User.objects.get(username='ann').check_password('secret123'))
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+        self.assertEqual(UserProfile.objects.filter(user__username__in=['ann', 'bob']).count(), 2)
+
+        with self.assertRaisesMessage(CommandError, 'Line 2: password is not a Django password hash.'):
+            call_command('import_users', self.write_csv([['username', 'password'], ['cat', 'plain']]))
+
+    def write_csv(self, rows):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False)
+        with f:
+            csv.writer(f).writerows(rows)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+
+class DatabaseProfileTests(LibraryTestCase):
+    def test_sqlite_connections_are_tuned(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite profile only')
+        with connection.cursor() as cursor:
+            pragmas = {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size')
+            }
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20_000, 'mmap_size': 256 * 1024 * 1024,
+        })
+
+
+class PrefixSearchIndexTests(LibraryTestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_istartswith_searches_the_prefix_indexes(self):
+        self.assertIn('USING COVERING INDEX book_title_prefix_idx (title>? AND title<?)',
+                      Book.objects.filter(title__istartswith='sha').values('pk').explain())
+        self.assertIn('USING COVERING INDEX author_name_prefix_idx (name>? AND name<?)',
+                      Author.objects.filter(name__istartswith='sha').values('pk').explain())
+
+    def test_matches_ignore_case(self):
+        make_catalogue(1)
+        self.assertEqual(Book.objects.filter(title__istartswith='BOOK').count(), 1)
+        self.assertEqual(Author.objects.filter(name__istartswith='author 1').count(), 1)
+
+
+class InstrumentationTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        for histogram in metrics.REGISTRY:
+            histogram.clear()
+        self.books = make_catalogue(3, authors_per_book=1)
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+
+    def test_records_request_metrics_per_endpoint(self):
+        self.client.get(reverse('books'))
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+
+        labels = 'endpoint="api/books/",method="GET",status="200"'
+        self.assertIn(f'bfool_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'bfool_request_db_queries_bucket{{{labels},le="2"}} 1', body)
+        self.assertIn(f'bfool_request_db_queries_bucket{{{labels},le="1"}} 0', body)
+        self.assertIn(f'bfool_request_render_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'bfool_response_size_bytes_count{{{labels}}} 1', body)
+
+    def test_render_time_excludes_compression(self):
+        real_compress = CompressionMiddleware.process_response
+
+        def slow_compress(middleware, request, response):
+            time.sleep(0.3)
+            return real_compress(middleware, request, response)
+
+        with mock.patch.object(CompressionMiddleware, 'process_response', slow_compress):
+            self.client.get(reverse('books'), HTTP_ACCEPT_ENCODING='gzip')
+        labels = 'endpoint="api/books/",method="GET",status="200"'
+        self.assertIn(f'bfool_request_render_duration_seconds_bucket{{{labels},le="0.25"}} 1', metrics.expose())
+        self.assertIn(f'bfool_request_duration_seconds_bucket{{{labels},le="0.25"}} 0', metrics.expose())
+
+    def test_metrics_are_admin_only(self):
+        self.assertIn(self.client.get(reverse('metrics')).status_code, (401, 403))
+
+    async def test_async_views_are_instrumented(self):
+        await AsyncClient().get(reverse('async-books'))
+        body = metrics.expose()
+        self.assertIn('bfool_request_db_queries_bucket{endpoint="api/async/books/",method="GET",status="200",le="2"} 1', body)
+
+    def test_slow_queries_are_logged(self):
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs('bfoolapp.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('books'))
+        self.assertTrue(any('bfoolapp_book' in record.sql for record in logs.records))
+
+    def test_book_creation_is_logged_not_printed(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertLogs('bfoolapp.views', 'INFO') as logs:
+            self.client.post(reverse('books'), {'title': 'x'}, format='json')
+        self.assertEqual(logs.records[0].getMessage(), 'book rejected')
+        self.assertIn('category_id', logs.records[0].errors)
+
+
+class SyntheticDataTests(LibraryTestCase):
+    def test_generated_data_is_consistent(self):
+        call_command(
+            'generate_data', '--users', '20', '--authors', '5', '--categories', '3', '--books', '30',
+            '--borrows', '400', '--active-ratio', '0.5', stdout=io.StringIO(),
+        )
+        self.assertEqual((User.objects.count(), UserProfile.objects.count(), Book.objects.count()), (20, 20, 30))
+        self.assertEqual(Borrow.objects.count(), 400)
+        self.assertTrue(Borrow.objects.active().exists())
+        self.assertFalse(Book.objects.filter(available_copies__lt=0).exists())
+
+        out = io.StringIO()
+        call_command('reconcile_loans', stdout=out)
+        self.assertIn('No drift found.', out.getvalue())
+        title_word = search.tokenize(Book.objects.first().title)[0]
+        self.assertTrue(search.search_books(title_word, limit=1))
+
+    def test_every_endpoint_has_a_benchmark_scenario(self):
+        missing = [
+            (name, method) for name, method in endpoints()
+            if not hasattr(Scenarios, scenario_name(name, method))
+        ]
+        self.assertEqual(missing, [])
+
+
+class HoldQueueTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_catalogue(1, authors_per_book=1)[0]
+        Book.objects.filter(pk=self.book.pk).update(total_copies=1, available_copies=0)
+        self.lender = User.objects.create_user(username='lender', password='pass12345')
+        self.loan = make_loan(self.lender, self.book, timezone.now().date() + timedelta(days=14))
+        self.users = [User.objects.create_user(username=f'reader{i}', password='pass12345') for i in range(3)]
+
+    def place(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('holds'), {'book_id': self.book.id})
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def give_back(self):
+        self.client.force_authenticate(self.lender)
+        self.assertEqual(self.client.post(reverse('return-book'), {'borrow_id': self.loan.id}).status_code, 200)
+
+    def counters(self):
+        return Book.objects.filter(pk=self.book.pk).values_list('available_copies', 'waitlist_length').get()
+
+    def test_borrow_without_copies_points_to_holds(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(reverse('borrow-book'), {'book_id': self.book.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.data['hold_url'].endswith(reverse('holds')))
+
+    def test_queue_positions_and_duplicates(self):
+        holds = [self.place(user) for user in self.users]
+        self.assertEqual([hold['position'] for hold in holds], [1, 2, 3])
+        self.assertEqual(self.counters(), (0, 3))
+
+        response = self.client.post(reverse('holds'), {'book_id': self.book.id})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(self.users[1])
+        self.client.delete(reverse('hold-detail', args=[holds[0]['id']]))  # not theirs
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.delete(reverse('hold-detail', args=[holds[0]['id']])).status_code, 204)
+        self.client.force_authenticate(self.users[2])
+        self.assertEqual(self.client.get(reverse('holds')).data[0]['position'], 2)
+        self.assertEqual(self.counters(), (0, 2))
+
+    def test_holds_only_when_nothing_is_on_the_shelf(self):
+        Book.objects.filter(pk=self.book.pk).update(available_copies=1)
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.post(reverse('holds'), {'book_id': self.book.id}).status_code, 400)
+
+    def test_return_goes_to_the_head_of_the_queue(self):
+        first, second = self.place(self.users[0]), self.place(self.users[1])
+        self.give_back()
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertEqual(Hold.objects.get(pk=first['id']).status, Hold.READY)
+
+        # Only the holder can take the copy
+        self.client.force_authenticate(self.users[1])
+        self.assertEqual(self.client.post(reverse('borrow-book'), {'book_id': self.book.id}).status_code, 400)
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.post(reverse('borrow-book'), {'book_id': self.book.id}).status_code, 201)
+        self.assertEqual(Hold.objects.get(pk=first['id']).status, Hold.FULFILLED)
+        self.assertEqual(Hold.objects.get(pk=second['id']).status, Hold.WAITING)
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_cancelling_a_ready_hold_passes_the_copy_on(self):
+        first, second = self.place(self.users[0]), self.place(self.users[1])
+        self.give_back()
+        self.client.force_authenticate(self.users[0])
+        self.client.delete(reverse('hold-detail', args=[first['id']]))
+        self.assertEqual(Hold.objects.get(pk=second['id']).status, Hold.READY)
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_expired_holds_move_down_the_queue_then_to_the_shelf(self):
+        first, second = self.place(self.users[0]), self.place(self.users[1])
+        self.give_back()
+        later = timezone.now() + timedelta(days=4)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(expire_holds(), {'expired': 1, 'reallocated': 1})
+        self.assertEqual(Hold.objects.get(pk=first['id']).status, Hold.EXPIRED)
+        self.assertEqual(Hold.objects.get(pk=second['id']).status, Hold.READY)
+
+        out = io.StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=later + timedelta(days=4)):
+            call_command('expire_holds', stdout=out)
+        self.assertIn('Expired 1 hold(s), 0 copy(ies)', out.getvalue())
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_expiry_locks_the_holds_it_releases(self):
+        self.place(self.users[0])
+        self.give_back()
+        later = timezone.now() + timedelta(days=4)
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+                mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                                  side_effect=QuerySet.select_for_update) as locked:
+            expire_holds()
+        self.assertIn(Hold, [call.args[0].model for call in locked.call_args_list])
+
+    def test_bulk_return_allocates_and_bulk_borrow_fulfils(self):
+        hold = self.place(self.users[0])
+        self.client.force_authenticate(self.lender)
+        self.client.post(reverse('bulk-return'), {'borrow_ids': [self.loan.id]}, format='json')
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(reverse('bulk-borrow'), {'book_ids': [self.book.id, self.book.id]}, format='json')
+        self.assertIn('borrow_id', response.data['results'][0])
+        self.assertEqual(response.data['results'][1]['error'], 'No available copies to borrow.')
+        self.assertEqual(Hold.objects.get(pk=hold['id']).status, Hold.FULFILLED)
+        self.assertEqual(self.counters(), (0, 0))
+
+    async def test_long_poll_returns_on_change_or_timeout(self):
+        hold = await sync_to_async(place_hold)(self.users[0], self.book)
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.users[0])}'}
+        url = reverse('async-hold-status', args=[hold.pk])
+
+        response = await client.get(url, {'status': 'waiting', 'wait': 0}, headers=headers)
+        self.assertEqual(response.json()['position'], 1)
+
+        async def ready_soon():
+            await asyncio.sleep(0.2)
+            await Hold.objects.filter(pk=hold.pk).aupdate(status=Hold.READY)
+
+        with mock.patch('bfoolapp.async_views.AsyncHoldStatusView.poll_interval', 0.05):
+            started = time.monotonic()
+            response, _ = await asyncio.gather(
+                client.get(url, {'status': 'waiting', 'wait': 5}, headers=headers), ready_soon()
+            )
+        self.assertEqual(response.json()['status'], Hold.READY)
+        self.assertLess(time.monotonic() - started, 2)
+
+        other = {'Authorization': f'Bearer {AccessToken.for_user(self.users[1])}'}
+        self.assertEqual((await client.get(url, headers=other)).status_code, 404)
+
+
+class AdminChangeListTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        self.client.force_login(self.admin)
+        self.books = make_catalogue(2, authors_per_book=1)
+        self.url = reverse('admin:bfoolapp_borrow_changelist')
+
+    def lend(self, count, username='reader'):
+        user = User.objects.create_user(username=f'{username}{Borrow.objects.count()}')
+        today = timezone.now().date()
+        return [make_loan(user, self.books[i % 2], today + timedelta(days=14)) for i in range(count)]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.lend(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        self.lend(20)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(small), len(large))
+        self.assertNotIn('COUNT(*) AS', ' '.join(q['sql'] for q in large.captured_queries))
+
+    def test_search_matches_username_and_title_prefixes(self):
+        mine = self.lend(1, username='zelda')
+        self.lend(1, username='alice')
+        response = self.client.get(self.url, {'q': 'zel'})
+        self.assertEqual([borrow.pk for borrow in response.context['cl'].result_list], [mine[0].pk])
+        response = self.client.get(self.url, {'q': 'BOOK 0'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertEqual(len(self.client.get(self.url, {'q': 'elda'}).context['cl'].result_list), 0)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_searches_use_indexes(self):
+        plan = self.client.get(self.url, {'q': 'zel'}).context['cl'].queryset.explain()
+        self.assertIn('USING COVERING INDEX book_title_prefix_idx', plan)
+        self.assertIn('(username>? AND username<?)', plan)
+        self.assertNotIn('SCAN bfoolapp_borrow', plan)
+        for name, index in (('book', 'book_title_prefix_idx'), ('author', 'author_name_prefix_idx')):
+            plan = self.client.get(reverse(f'admin:bfoolapp_{name}_changelist'), {'q': 'x'}).context['cl'].queryset.explain()
+            self.assertIn(f'USING INDEX {index}', plan)
+
+    def test_date_hierarchy_seeks_instead_of_aggregating(self):
+        self.lend(3)
+        today = timezone.now().date()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        # Every loan is from this month, so the hierarchy starts at its days
+        self.assertContains(response, f'?borrow_date__day={today.day}&amp;borrow_date__month={today.month}&amp;')
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        for scan in ('MIN(', 'MAX(', 'DISTINCT'):
+            self.assertNotIn(scan, sql)
+
+    def test_large_tables_get_an_estimated_or_capped_count(self):
+        loans = self.lend(5)
+        loans[2].delete()
+        with mock.patch.object(EstimatedCountPaginator, 'count_limit', 2):
+            unfiltered = self.client.get(self.url).context['cl']
+            filtered = self.client.get(self.url, {'status': 'active'}).context['cl']
+        self.assertEqual(unfiltered.result_count, 5)  # the span of the ids
+        self.assertEqual(filtered.result_count, 2)
+        self.assertEqual(self.client.get(self.url).context['cl'].result_count, 4)
+
+    def test_status_filter_and_date_hierarchy(self):
+        loans = self.lend(3)
+        Borrow.objects.filter(pk=loans[0].pk).update(borrow_date=date(2023, 5, 2), due_date=date(2023, 5, 16))
+        Borrow.objects.filter(pk=loans[1].pk).update(borrow_date=date(2025, 3, 1), return_date=date(2025, 3, 9))
+        response = self.client.get(self.url, {'status': 'overdue'})
+        self.assertEqual([borrow.pk for borrow in response.context['cl'].result_list], [loans[0].pk])
+
+        response = self.client.get(self.url)
+        for year in range(2023, timezone.now().year + 1):  # 2024, with no loans, too
+            self.assertContains(response, f'?borrow_date__year={year}"')
+        response = self.client.get(self.url, {'borrow_date__year': 2023})
+        self.assertContains(response, '?borrow_date__month=5&amp;borrow_date__year=2023"')
+        self.assertNotContains(response, '?borrow_date__month=6&amp;')
+        self.assertEqual([borrow.pk for borrow in response.context['cl'].result_list], [loans[0].pk])
+
+    def test_csv_export_streams_the_selection(self):
+        loans = self.lend(3)
+        response = self.client.post(self.url, {
+            'action': 'export_csv', 'index': 0, '_selected_action': [loans[0].pk, loans[2].pk],
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'user_id', 'user__username'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [loans[0].pk, loans[2].pk])
+
+    def test_service_owned_tables_cannot_be_edited_by_hand(self):
+        loan = self.lend(1)[0]
+        entry = PenaltyEntry.objects.create(user=loan.user, borrow=loan, points=2, reason=PenaltyEntry.OVERDUE)
+        for name in ('archivedborrow', 'penaltyentry', 'hold'):
+            self.assertEqual(self.client.get(reverse(f'admin:bfoolapp_{name}_add')).status_code, 403)
+            self.assertEqual(self.client.get(reverse(f'admin:bfoolapp_{name}_changelist')).status_code, 200)
+        self.assertEqual(self.client.post(reverse('admin:bfoolapp_penaltyentry_delete', args=[entry.pk]),
+                                          {'post': 'yes'}).status_code, 403)
+        response = self.client.post(reverse('admin:bfoolapp_penaltyentry_change', args=[entry.pk]), {'points': 9})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(PenaltyEntry.objects.get(pk=entry.pk).points, 2)
+
+    def test_change_forms_do_not_list_every_row(self):
+        for name in ('bfoolapp_borrow_add', 'bfoolapp_book_add', 'bfoolapp_userprofile_changelist'):
+            self.assertEqual(self.client.get(reverse(f'admin:{name}')).status_code, 200)
+        form = self.client.get(reverse('admin:bfoolapp_book_add')).content.decode()
+        self.assertNotIn('Author 0', form)  # authors are fetched by the autocomplete widget
+
+
+class ThrottlingTests(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_catalogue(1, authors_per_book=1)[0]
+        self.user = User.objects.create_user(username='poller', password='pass12345')
+        self.clock = mock.patch('bfoolapp.throttling.time').start()
+        self.clock.time.return_value = 1000.0
+        self.addCleanup(mock.patch.stopall)
+
+    def test_anonymous_bucket_empties_and_refills(self):
+        with throttle_rates(anon='3/min'):
+            statuses = [self.client.get(reverse('books')).status_code for _ in range(4)]
+            self.assertEqual(statuses, [200, 200, 200, 429])
+            response = self.client.get(reverse('books'))
+            self.assertEqual(response['Retry-After'], '20')
+            self.clock.time.return_value += 20
+            self.assertEqual(self.client.get(reverse('books')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('books')).status_code, 429)
+            # Signed-in users have their own bucket
+            self.client.force_authenticate(self.user)
+            self.assertEqual(self.client.get(reverse('books')).status_code, 200)
+
+    def test_writes_cost_more_than_reads(self):
+        Book.objects.filter(pk=self.book.pk).update(available_copies=0)
+        self.client.force_authenticate(self.user)
+        with throttle_rates(user='7/min'):
+            statuses = [
+                self.client.post(reverse('borrow-book'), {'book_id': self.book.id}, format='json').status_code
+                for _ in range(3)
+            ]
+            self.assertEqual(statuses, [400, 400, 429])
+            self.assertEqual(self.client.get(reverse('borrow-book')).status_code, 200)  # the last token
+
+    def test_burst_scope_covers_everyone_and_async_views(self):
+        with throttle_rates(burst='2/s'):
+            self.assertEqual(self.client.get(reverse('books')).status_code, 200)
+            response = async_to_sync(AsyncClient().get)(reverse('async-books'))
+            self.assertEqual(response.status_code, 200)
+            response = async_to_sync(AsyncClient().get)(reverse('async-books'))
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+        with throttle_rates():
+            self.assertEqual(self.client.get(reverse('books')).status_code, 200)
+
+
+class CoalescingTests(LibraryTestCase):
+    def test_concurrent_callers_share_one_build(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def build():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'page': 1}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalesced('key', build)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(coalesced('key', build))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'page': 1}] * 4)
+        self.assertEqual(coalesced('key', lambda: 'fresh'), 'fresh')
+
+    def test_failures_are_not_remembered(self):
+        with self.assertRaises(ValueError):
+            coalesced('key', lambda: int('x'))
+        self.assertEqual(coalesced('key', lambda: 2), 2)
+
+    def test_catalogue_list_and_search_go_through_it(self):
+        make_catalogue(2)
+        with mock.patch('bfoolapp.cache.coalesced', wraps=coalesced) as spy:
+            self.client.get(reverse('books'))
+            self.client.get(reverse('books'))  # cached
+            self.client.get(reverse('books-search'), {'q': 'book'})
+            with override_settings(CATALOGUE_COALESCE=False):
+                self.client.get(reverse('books-search'), {'q': 'book'})
+        self.assertEqual([call.args[0].split(':')[1] for call in spy.call_args_list], ['response', 'search'])
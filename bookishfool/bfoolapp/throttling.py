@@ -0,0 +1,109 @@
+"""
+Token-bucket request throttles for the ``anon``, ``user`` and ``burst`` scopes.
+
+A rate 'N/period' (period: s, m, h or d) is a bucket of N tokens refilled at
+N per period: a client may spend the whole bucket at once, then gets one
+request per period/N. Unsafe methods cost ``write_cost`` tokens, since each
+one queues for the single SQLite writer.
+
+DRF's own throttles keep a list of request times per client and rewrite it on
+every request; a bucket is two numbers. Buckets live in the ``throttle``
+cache (local memory by default, so limits are per process; point it at a
+shared cache to limit across processes). Rates are read per request from
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']; a scope without a rate is off.
+"""
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Makes each bucket's read-refill-write atomic within the process
+_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """'N/period' -> (capacity, tokens per second)."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / DURATIONS[period[0]]
+
+
+def is_authenticated(request):
+    # DRF requests carry AnonymousUser; the async views set None
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+    cache_alias = 'throttle'
+    write_cost = 3
+
+    def __init__(self):
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        self.tokens = None
+
+    def get_cache_key(self, request, view):
+        """The bucket for this request, or None to let it through."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        self.capacity, self.refill = parse_rate(self.rate)
+        self.cost = 1 if request.method in SAFE_METHODS else min(self.write_cost, self.capacity)
+        cache = caches[self.cache_alias]
+        now = time.time()
+        with _lock:
+            tokens, updated = cache.get(key) or (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(now - updated, 0) * self.refill)
+            allowed = tokens >= self.cost
+            if allowed:
+                tokens -= self.cost
+            # Once the bucket would be full again, a missing key means the same thing
+            cache.set(key, (tokens, now), math.ceil((self.capacity - tokens) / self.refill) + 1)
+        self.tokens = tokens
+        return allowed
+
+    def wait(self):
+        if self.tokens is None:
+            return None
+        return max(self.cost - self.tokens, 0) / self.refill
+
+
+class AnonBucketThrottle(TokenBucketThrottle):
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if is_authenticated(request):
+            return None
+        return f'throttle:anon:{self.get_ident(request)}'
+
+
+class UserBucketThrottle(TokenBucketThrottle):
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not is_authenticated(request):
+            return None
+        return f'throttle:user:{request.user.pk}'
+
+
+class BurstBucketThrottle(TokenBucketThrottle):
+    # Short-term ceiling for everyone, on top of the sustained anon/user rates
+    scope = 'burst'
+
+    def get_cache_key(self, request, view):
+        if is_authenticated(request):
+            return f'throttle:burst:user:{request.user.pk}'
+        return f'throttle:burst:anon:{self.get_ident(request)}'
@@ -1,5 +1,9 @@
 from django.urls import path
 from .views import *
+from .async_views import (
+    AsyncActiveBorrowListView, AsyncAuthorListView, AsyncBookListView,
+    AsyncCategoryListView, AsyncHoldStatusView, AsyncUserPenaltyView,
+)
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -10,12 +14,31 @@ urlpatterns = [
     path('api/login/', TokenObtainPairView.as_view(), name='login'),
     path('api/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/books/', BookListAPIView.as_view(), name='books'),
+    path('api/books/search/', BookSearchAPIView.as_view(), name='books-search'),
+    path('api/books/export/', BookExportAPIView.as_view(), name='books-export'),
+    path('api/books/bulk/', BookBulkAPIView.as_view(), name='books-bulk'),
     path('api/books/<int:pk>', BookDetailAPIView.as_view(), name='books_details'),
     path('api/authors/', AuthorListCreateAPIView.as_view(), name='author-list-create'),
     path('api/authors/<int:pk>/', AuthorDetailAPIView.as_view(), name='author-detail'),
+    path('api/authors/bulk/', AuthorBulkAPIView.as_view(), name='author-bulk'),
     path('api/categories/', CategoryListCreateAPIView.as_view(), name='category-list-create'),
     path('api/categories/<int:pk>/', CategoryDetailAPIView.as_view(), name='category-detail'),
+    path('api/categories/bulk/', CategoryBulkAPIView.as_view(), name='category-bulk'),
     path('api/borrow/', BorrowBookAPIView.as_view(), name='borrow-book'),
     path('api/return/', ReturnBookAPIView.as_view(), name='return-book'),
+    path('api/borrow/bulk/', BulkBorrowAPIView.as_view(), name='bulk-borrow'),
+    path('api/return/bulk/', BulkReturnAPIView.as_view(), name='bulk-return'),
+    path('api/holds/', HoldListCreateAPIView.as_view(), name='holds'),
+    path('api/holds/<int:pk>/', HoldDetailAPIView.as_view(), name='hold-detail'),
     path('api/users/<int:id>/penalties/', UserPenaltyView.as_view(), name='user-penalties'),
-]
\ No newline at end of file
+    path('api/users/<int:id>/loans/', LoanHistoryAPIView.as_view(), name='user-loans'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+
+    # Async (ASGI) read endpoints
+    path('api/async/books/', AsyncBookListView.as_view(), name='async-books'),
+    path('api/async/authors/', AsyncAuthorListView.as_view(), name='async-authors'),
+    path('api/async/categories/', AsyncCategoryListView.as_view(), name='async-categories'),
+    path('api/async/borrow/', AsyncActiveBorrowListView.as_view(), name='async-borrow'),
+    path('api/async/users/<int:id>/penalties/', AsyncUserPenaltyView.as_view(), name='async-user-penalties'),
+    path('api/async/holds/<int:id>/', AsyncHoldStatusView.as_view(), name='async-hold-status'),
+]
@@ -1,14 +1,41 @@
-from django.shortcuts import render, get_object_or_404
+import logging
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser, AllowAny
-from rest_framework.exceptions import PermissionDenied
-from datetime import datetime, timedelta
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from .serializers import *
 from .models import *
+from . import metrics
+from .authentication import StatelessReadsMixin
+from .cache import cached_catalogue_response, catalogue_etag, catalogue_last_modified, coalesced_catalogue_build
+from .exports import csv_lines, ndjson_lines
+from .ingest import AuthorIngestion, BookIngestion, CategoryIngestion
+from .pagination import KeysetPagination, PopularityPagination
+from .representations import (
+    AUTHOR_OUTPUT, BOOK_EXPANDABLE, BOOK_OUTPUT, BORROW_EXPANDABLE, BORROW_OUTPUT, Fieldset, FieldsetError,
+    author_rows, book_columns, book_rows, borrow_rows, category_rows, export_book_chunks, hold_rows,
+    loan_history_rows, represent_authors, represent_books, represent_borrows, represent_categories,
+    represent_holds, represent_loan_history,
+)
+from .search import search_books, tokenize
+from .services import (
+    InventoryError, NoCopiesAvailable, borrow_book, return_book, bulk_borrow_books, bulk_return_books,
+    cancel_hold, hold_positions, place_hold,
+)
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
+
 class RegisterView(APIView):
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
@@ -19,7 +46,23 @@ class RegisterView(APIView):
     
 
 
-class BookListAPIView(APIView):
+def requested_fieldset(request, available, expandable=()):
+    try:
+        return Fieldset.from_query(request.query_params, available, expandable)
+    except FieldsetError as e:
+        raise ValidationError({e.param: str(e)})
+
+
+class KeysetPaginatedMixin:
+    pagination_class = KeysetPagination
+
+    def paginate(self, rows, represent, pagination_class=None):
+        paginator = (pagination_class or self.pagination_class)()
+        page = paginator.paginate_queryset(rows, self.request, view=self)
+        return paginator.get_paginated_response(represent(page))
+
+
+class BookListAPIView(StatelessReadsMixin, KeysetPaginatedMixin, APIView):
     def get_permissions(self):
         if self.request.method == 'GET':
             return [permission() for permission in [AllowAny]]  # Anyone can view
@@ -27,8 +70,14 @@ class BookListAPIView(APIView):
             return [permission() for permission in [IsAdminUser]]  # Only admin can create
         return super().get_permissions()
 
+    @method_decorator(condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified))
     def get(self, request):
+        return Response(cached_catalogue_response(request, lambda: self.list_books(request).data))
+
+    def list_books(self, request):
         queryset = Book.objects.all()
+        fieldset = requested_fieldset(request, BOOK_OUTPUT, BOOK_EXPANDABLE)
+        represent = lambda page: represent_books(page, fieldset=fieldset)
 
         author_id = request.query_params.get('author')
         category_id = request.query_params.get('category')
@@ -37,21 +86,131 @@ class BookListAPIView(APIView):
             queryset = queryset.filter(authors__id=author_id)
         if category_id:
             queryset = queryset.filter(category__id=category_id)
+        if request.query_params.get('available') == 'true':
+            queryset = queryset.filter(available_copies__gt=0)  # book_available_idx
 
-        serializer = BookSerializer(queryset, many=True)
-        return Response(serializer.data)
+        ordering = request.query_params.get('ordering')
+        if ordering == 'popular':
+            rows = queryset.values(*book_columns(fieldset), 'recent_borrow_count')
+            return self.paginate(rows, represent, PopularityPagination)
+        if ordering:
+            raise ValidationError({'ordering': 'Only "popular" is supported.'})
+        return self.paginate(book_rows(queryset, fieldset), represent)
 
     def post(self, request):
         serializer = BookSerializer(data=request.data)
         if serializer.is_valid():
-            print("Validated Data:", serializer.validated_data)
-            serializer.save()
+            book = serializer.save()
+            logger.info('book created', extra={'book_id': book.pk, 'user_id': request.user.pk})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            print("Errors:", serializer.errors)
+        logger.info('book rejected', extra={'errors': serializer.errors, 'user_id': request.user.pk})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BookSearchAPIView(StatelessReadsMixin, APIView):
+    permission_classes = [AllowAny]
+    max_page_size = KeysetPagination.max_page_size
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        fieldset = requested_fieldset(request, BOOK_OUTPUT, BOOK_EXPANDABLE)
+        if not tokenize(query):
+            return Response({'error': 'q is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', api_settings.PAGE_SIZE)), 1), self.max_page_size)
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(coalesced_catalogue_build(
+            request, lambda: self.search(request, query, fieldset, page, page_size), 'search'
+        ))
+
+    def search(self, request, query, fieldset, page, page_size):
+        # One extra id tells us whether there is a next page without a COUNT(*)
+        ids = search_books(query, limit=page_size + 1, offset=(page - 1) * page_size)
+        has_next = len(ids) > page_size
+        ids = ids[:page_size]
+
+        rank = {book_id: position for position, book_id in enumerate(ids)}
+        books = represent_books(book_rows(Book.objects.filter(pk__in=ids), fieldset), fieldset=fieldset)
+        books.sort(key=lambda book: rank[book['id']])
+
+        url = request.build_absolute_uri()
+        return {
+            'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'results': books,
+        }
+
+
+class BookExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    chunk_size = 2000
+    content_types = {
+        'ndjson': ('application/x-ndjson', ndjson_lines),
+        'csv': ('text/csv', csv_lines),
+    }
+
+    def get(self, request):
+        # `format` is taken by DRF's renderer override, hence `type`
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in self.content_types:
+            return Response({'error': 'type must be ndjson or csv.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = Book.objects.all()
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({'error': 'since must be an ISO 8601 datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        content_type, lines = self.content_types[export_type]
+        response = StreamingHttpResponse(
+            lines(export_book_chunks(queryset, self.chunk_size)), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="books.{export_type}"'
+        return response
+
+
+class BulkIngestAPIView(APIView):
+    """POST {"items": [...]}: create or update many rows at once, see ingest.py."""
+    permission_classes = [IsAdminUser]
+    ingestion_class = None
+
+    def post(self, request):
+        serializer = BulkIngestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = self.ingestion_class().run(serializer.validated_data['items'])
+        summary = {
+            'created': sum(1 for result in results if result.get('created') is True),
+            'updated': sum(1 for result in results if result.get('created') is False),
+            'failed': sum(1 for result in results if 'error' in result),
+        }
+        # `created` is a LogRecord attribute
+        logger.info('bulk ingest', extra={
+            'model': self.ingestion_class.model.__name__, 'user_id': request.user.pk,
+            **{f'rows_{outcome}': count for outcome, count in summary.items()},
+        })
+        return Response({**summary, 'results': results})
+
+
+class BookBulkAPIView(BulkIngestAPIView):
+    ingestion_class = BookIngestion
+
+
+class AuthorBulkAPIView(BulkIngestAPIView):
+    ingestion_class = AuthorIngestion
+
+
+class CategoryBulkAPIView(BulkIngestAPIView):
+    ingestion_class = CategoryIngestion
+
+
 class BookDetailAPIView(APIView):
     def get_object(self, pk):
         return get_object_or_404(Book, pk=pk)
@@ -73,11 +232,10 @@ class BookDetailAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class AuthorListCreateAPIView(APIView):
+class AuthorListCreateAPIView(KeysetPaginatedMixin, APIView):
     def get(self, request):
-        authors = Author.objects.all()
-        serializer = AuthorSerializer(authors, many=True)
-        return Response(serializer.data)
+        fieldset = requested_fieldset(request, AUTHOR_OUTPUT)
+        return self.paginate(author_rows(fieldset=fieldset), lambda page: represent_authors(page, fieldset))
 
     permission_classes = [IsAdminUser]
 
@@ -109,11 +267,9 @@ class AuthorDetailAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CategoryListCreateAPIView(APIView):
+class CategoryListCreateAPIView(KeysetPaginatedMixin, APIView):
     def get(self, request):
-        categories = Category.objects.all()
-        serializer = CategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        return self.paginate(category_rows(), represent_categories)
 
     permission_classes = [IsAdminUser]
 
@@ -145,14 +301,14 @@ class CategoryDetailAPIView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class BorrowBookAPIView(APIView):
+class BorrowBookAPIView(StatelessReadsMixin, APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get(self, request):
-        user = request.user
-        active_borrows = Borrow.objects.filter(user=user, return_date__isnull=True)
-        serializer = BorrowSerializer(active_borrows, many=True)
-        return Response(serializer.data)
+        # request.user is a TokenUser here, so filter on the id
+        fieldset = requested_fieldset(request, BORROW_OUTPUT, BORROW_EXPANDABLE)
+        active_borrows = Borrow.objects.filter(user_id=request.user.id).active().order_by('id')
+        return Response(represent_borrows(borrow_rows(active_borrows, fieldset), fieldset=fieldset))
 
     def post(self, request):
         user = request.user
@@ -162,22 +318,13 @@ class BorrowBookAPIView(APIView):
 
         book = get_object_or_404(Book, id=book_id)
 
-        active_borrows = Borrow.objects.filter(user=user, return_date__isnull=True).count()
-        if active_borrows >= 3:
-            return Response({'error': 'You can only borrow up to 3 books at a time.'}, status=400)
-
-        if book.available_copies < 1:
-            return Response({'error': 'No available copies to borrow.'}, status=400)
-
-        book.available_copies -= 1
-        book.save()
-
-        borrow = Borrow.objects.create(
-            user=user,
-            book=book,
-            borrow_date=timezone.now().date(),
-            due_date=timezone.now().date() + timedelta(days=14)
-        )
+        try:
+            borrow = borrow_book(user, book)
+        except NoCopiesAvailable as e:
+            # Queue instead of retrying: POST the book_id here, then wait on the hold's status_url
+            return Response({'error': str(e), 'hold_url': request.build_absolute_uri(reverse('holds'))}, status=400)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=400)
 
         return Response({'message': f'You have borrowed "{book.title}". Return by {borrow.due_date}.'}, status=201)
 
@@ -190,35 +337,125 @@ class ReturnBookAPIView(APIView):
         borrow_id = request.data.get('borrow_id')
         borrow = get_object_or_404(Borrow, id=borrow_id, user=user)
 
-        if borrow.return_date:
-            return Response({'error': 'Book already returned.'}, status=400)
-
-        borrow.return_date = timezone.now().date()
-        borrow.save()
+        try:
+            late_days = return_book(user, borrow)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=400)
 
-        book = borrow.book
-        book.available_copies += 1
-        book.save()
-
-        if borrow.return_date > borrow.due_date:
-            late_days = (borrow.return_date - borrow.due_date).days
-            user_profile = user.userprofile
-            user_profile.penalty_point += late_days
-            user_profile.save()
+        if late_days:
             return Response({'message': f'Book returned. {late_days} penalty point(s) added for late return.'})
 
         return Response({'message': 'Book returned successfully.'})
 
 
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class BulkBorrowAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkBorrowSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = bulk_borrow_books(request.user, serializer.validated_data['book_ids'])
+        except InventoryError as e:
+            # Another request changed the user's loans or the stock mid-batch; nothing was borrowed
+            return Response({'error': str(e)}, status=400)
+        return Response({'results': results})
+
+
+class BulkReturnAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkReturnSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = bulk_return_books(request.user, serializer.validated_data['borrow_ids'])
+        return Response({'results': results})
+
+
 class UserPenaltyView(APIView):
+    # Not StatelessReadsMixin: is_staff must come from the database, not a token that predates a demotion
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def get(self, request, id):
-        user = get_object_or_404(User, id=id)
-
-        if request.user != user and not request.user.is_staff:
+        if request.user.id != id and not request.user.is_staff:
             raise PermissionDenied('Not authorized to view this user\'s penalties.')
 
-        return Response({'username': user.username, 'penalty_points': user.userprofile.penalty_point})
+        try:
+            profile = UserProfile.objects.select_related('user').get(user_id=id)
+        except UserProfile.DoesNotExist:
+            # Bulk-imported users get their profile on first access
+            profile, _ = UserProfile.objects.get_or_create(user=get_object_or_404(User, pk=id))
+        return Response({'username': profile.user.username, 'penalty_points': profile.penalty_point})
+
+
+
 
+class LoanHistoryAPIView(APIView):
+    # Checks is_staff, so authenticated like UserPenaltyView
+    permission_classes = [IsAuthenticated]
+    max_page_size = KeysetPagination.max_page_size
 
+    def get(self, request, id):
+        if request.user.id != id and not request.user.is_staff:
+            raise PermissionDenied('Not authorized to view this user\'s loans.')
+        try:
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+            page_size = min(max(int(request.query_params.get('page_size', api_settings.PAGE_SIZE)), 1), self.max_page_size)
+        except ValueError:
+            return Response({'error': 'before and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Newest first; one extra row tells us whether there is an older page
+        rows = loan_history_rows(id, page_size + 1, before=before)
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(), 'before', rows[-1]['id']) if has_next else None,
+            'previous': None,
+            'results': represent_loan_history(rows),
+        })
+
+
+class HoldListCreateAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        rows = list(hold_rows(Hold.objects.filter(user=request.user, status__in=Hold.OPEN).order_by('id')))
+        return Response(represent_holds(rows, hold_positions([row['id'] for row in rows])))
+
+    def post(self, request):
+        book_id = request.data.get('book_id')
+        if not book_id:
+            return Response({'error': 'book_id is required.'}, status=400)
+
+        book = get_object_or_404(Book, id=book_id)
+
+        try:
+            hold = place_hold(request.user, book)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=400)
+
+        data = HoldSerializer(hold, context={'positions': hold_positions([hold.pk])}).data
+        data['status_url'] = request.build_absolute_uri(reverse('async-hold-status', args=[hold.pk]))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class HoldDetailAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, pk):
+        hold = get_object_or_404(Hold, pk=pk, user=request.user)
+        try:
+            cancel_hold(request.user, hold)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(status=status.HTTP_204_NO_CONTENT)
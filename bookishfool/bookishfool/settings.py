@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bfoolapp.middleware.PerformanceMiddleware',  # outermost, so it times everything below
+    # Compresses what ConditionalGetMiddleware lets through (and weakens its ETags)
+    'bfoolapp.middleware.CompressionMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,12 +80,129 @@ WSGI_APPLICATION = 'bookishfool.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# BFOOL_DB_PROFILE picks the profile: 'sqlite' (default, single host) or
+# 'postgres' (needs psycopg; `psycopg[pool]` for BFOOL_DB_POOL=1).
+
+DB_PROFILE = os.environ.get('BFOOL_DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Take the write lock at BEGIN so concurrent borrow/return transactions
+                # queue on the busy timeout instead of failing with "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            'TEST': {
+                # File-backed (not shared-cache memory) so threaded tests get real locking
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+elif DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('BFOOL_DB_NAME', 'bookishfool'),
+            'USER': os.environ.get('BFOOL_DB_USER', ''),
+            'PASSWORD': os.environ.get('BFOOL_DB_PASSWORD', ''),
+            'HOST': os.environ.get('BFOOL_DB_HOST', ''),
+            'PORT': os.environ.get('BFOOL_DB_PORT', ''),
+            # Reuse connections across requests; health checks drop ones the server closed
+            'CONN_MAX_AGE': int(os.environ.get('BFOOL_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('BFOOL_DB_POOL'):
+        # psycopg's pool replaces persistent connections (Django refuses both)
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {'min_size': 2, 'max_size': int(os.environ.get('BFOOL_DB_POOL_SIZE', 10)), 'timeout': 10},
+        }
+else:
+    raise ImproperlyConfigured(f'Unknown BFOOL_DB_PROFILE {DB_PROFILE!r}; use sqlite or postgres.')
+
+# Applied to every new SQLite connection (bfoolapp/db.py). WAL lets readers run
+# alongside the single writer, and synchronous=NORMAL is durable in WAL mode
+# short of power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20_000,  # ms, same as the 'timeout' option
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB
+    'temp_store': 'MEMORY',
+}
 
-DATABASES = {
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory is per process. To share the catalogue cache (and its version
+# counter) between workers use a cache server such as Redis or Memcached: the
+# cache also holds the User rows (password hashes included) cached by
+# CachedJWTAuthentication, so keep it off shared disks.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bookishfool',
+    },
+    # Token buckets of bfoolapp.throttling: small, hot and per client
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bookishfool-throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Seconds a cached /api/books/ response lives; catalogue edits invalidate earlier
+CATALOGUE_CACHE_TIMEOUT = 300
+
+# Concurrent identical catalogue requests that miss the cache wait for the
+# first one's response instead of all running the same queries
+CATALOGUE_COALESCE = True
+
+
+# Seconds an authenticated user (with profile) is cached by CachedJWTAuthentication;
+# saving the User or UserProfile invalidates earlier
+AUTH_USER_CACHE_TIMEOUT = 60
+
+SIMPLE_JWT = {
+    # Adds the username and is_staff claims read by stateless authentication
+    'TOKEN_OBTAIN_SERIALIZER': 'bfoolapp.serializers.LibraryTokenObtainPairSerializer',
+}
+
+
+# Catalogue search backend: 'fts5' (SQLite FTS5 table), 'python' (BookSearchTerm
+# inverted index, any database) or 'auto' (FTS5 when its table exists)
+SEARCH_BACKEND = 'auto'
+
+
+# Instrumentation: queries slower than this are logged to bfoolapp.slow_queries
+SLOW_QUERY_THRESHOLD_MS = 100
+
+
+# API JSON encoder (bfoolapp.renderers): 'orjson', 'stdlib' or 'auto' (orjson when installed)
+JSON_BACKEND = os.environ.get('BFOOL_JSON_BACKEND', 'auto')
+
+# Responses smaller than this many bytes are sent uncompressed
+GZIP_MIN_LENGTH = 1024
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'bfoolapp.log.JsonFormatter'},
+    },
+    'handlers': {
+        'json_console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'bfoolapp': {'handlers': ['json_console'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
 
@@ -102,11 +226,25 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'bfoolapp.authentication.CachedJWTAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
-
+    'DEFAULT_RENDERER_CLASSES': (
+        'bfoolapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'bfoolapp.pagination.KeysetPagination',
+    'PAGE_SIZE': 10,
+    # Token buckets (bfoolapp.throttling): capacity/refill period; writes cost 3 tokens
+    'DEFAULT_THROTTLE_CLASSES': (
+        'bfoolapp.throttling.AnonBucketThrottle',
+        'bfoolapp.throttling.UserBucketThrottle',
+        'bfoolapp.throttling.BurstBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '120/min',
+        'user': '600/min',
+        'burst': '30/s',
+    },
 }
 
 